@@ -0,0 +1,162 @@
+"""Minimum-total-distance assignment of pieces to target tiles.
+
+The assignment is solved as a min-cost matching over a sparse candidate graph:
+each piece may only be matched with its nearest candidate targets, and each
+target accepts up to `quota` pieces. The matching is grown one piece at a time
+by successive shortest augmenting paths, so after every step the matching is
+optimal for the pieces matched so far. When the time budget runs out, the rest
+of the pieces are matched greedily with their nearest target that still has a
+free place.
+"""
+from __future__ import annotations
+import heapq
+import time
+
+from common_types import Coordinates
+
+from profiling import profiled
+from spatial import PieceIndex
+
+DEFAULT_CANDIDATES = 8
+
+
+@profiled(name='assign')
+def assign(
+    pieces: dict[object, Coordinates],
+    targets: list[Coordinates],
+    quota: int = 1,
+    candidates: int = DEFAULT_CANDIDATES,
+    time_budget: None | float = None,
+) -> dict[object, Coordinates]:
+    """Assigns pieces to targets, minimizing the total L1 distance.
+
+    `pieces` maps each piece (any hashable object) to its location. `targets`
+    is a list of target coordinates; on equal distances, earlier targets are
+    preferred. Each target gets at most `quota` pieces. `time_budget` is the
+    amount of seconds after which the optimization stops, or None for no limit.
+
+    Returns a dict mapping each assigned piece to its target. Pieces are left
+    unassigned only if all the targets are full.
+    """
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    if not pieces or not targets or quota <= 0:
+        return {}
+
+    target_index = PieceIndex({i: target for i, target in enumerate(targets)})
+    piece_list = list(pieces)
+    locations = [pieces[piece] for piece in piece_list]
+    edges = [
+        target_index.nearest(location, max(candidates, quota))
+        for location in locations
+    ]
+
+    matching = _Matching(len(piece_list), len(targets), quota, edges)
+    unassigned = []
+    for i in range(len(piece_list)):
+        if deadline is not None and time.perf_counter() >= deadline:
+            unassigned.extend(range(i, len(piece_list)))
+            break
+        if not matching.augment(i):
+            unassigned.append(i)
+
+    # Greedy fallback, for pieces out of budget or without a free candidate.
+    for target, pieces_of_target in enumerate(matching.target_pieces):
+        if len(pieces_of_target) >= quota:
+            target_index.remove(target)
+    for i in unassigned:
+        nearest = target_index.nearest(locations[i])
+        if not nearest:
+            break
+        _, target = nearest[0]
+        matching.assign(i, target)
+        if len(matching.target_pieces[target]) >= quota:
+            target_index.remove(target)
+
+    return {
+        piece_list[i]: targets[target]
+        for i, target in enumerate(matching.piece_target)
+        if target is not None
+    }
+
+
+class _Matching:
+    """Successive shortest path matching over a sparse bipartite graph.
+
+    Nodes are numbered pieces first (0 .. n-1), then targets (n .. n+m-1).
+    Node potentials keep all the reduced costs non-negative, so every augmenting
+    path is found using Dijkstra, scanning only the nodes closer than the path.
+    """
+
+    def __init__(self, n, m, quota, edges):
+        self.n = n
+        self.quota = quota
+        self.edges = edges
+        self.costs = [dict((target, cost) for cost, target in piece_edges) for piece_edges in edges]
+        self.piece_target = [None] * n
+        self.target_pieces = [[] for _ in range(m)]
+        self.potentials = [0] * (n + m)
+
+    def assign(self, piece, target):
+        old_target = self.piece_target[piece]
+        if old_target is not None:
+            self.target_pieces[old_target].remove(piece)
+        self.piece_target[piece] = target
+        self.target_pieces[target].append(piece)
+
+    def augment(self, source) -> bool:
+        """Matches the given piece, possibly re-matching others.
+
+        Returns False if no augmenting path exists.
+        """
+        n = self.n
+        potentials = self.potentials
+        dist = {source: 0}
+        parent = {}
+        done = set()
+        queue = [(0, source)]
+        sink = None
+        while queue:
+            d, node = heapq.heappop(queue)
+            if node in done:
+                continue
+            done.add(node)
+            if node < n:
+                base = d + potentials[node]
+                current = self.piece_target[node]
+                for cost, target in self.edges[node]:
+                    if target == current:
+                        continue
+                    v = n + target
+                    nd = base + cost - potentials[v]
+                    if nd < dist.get(v, nd + 1):
+                        dist[v] = nd
+                        parent[v] = node
+                        heapq.heappush(queue, (nd, v))
+            else:
+                target = node - n
+                if len(self.target_pieces[target]) < self.quota:
+                    sink = node
+                    break
+                base = d + potentials[node]
+                for piece in self.target_pieces[target]:
+                    nd = base - self.costs[piece][target] - potentials[piece]
+                    if nd < dist.get(piece, nd + 1):
+                        dist[piece] = nd
+                        parent[piece] = node
+                        heapq.heappush(queue, (nd, piece))
+        if sink is None:
+            return False
+
+        # Raising all the potentials by dist[sink] would not change any reduced
+        # cost, so only the scanned nodes (closer than the sink) are updated.
+        limit = dist[sink]
+        for node in done:
+            potentials[node] += dist[node] - limit
+
+        node = sink
+        while True:
+            piece = parent[node]
+            self.assign(piece, node - n)
+            if piece == source:
+                return True
+            node = parent[piece]
@@ -0,0 +1,429 @@
+"""Per-turn indexes over the game board.
+
+The indexes here are built at most once per turn, and are cached until a new
+`TurnContext` is given. When turns are tracked (see `turn_state`), the owners
+grid and the distance maps of a turn are updated from those of the previous
+turn, so their arrays must never be modified by callers.
+
+`BoardGrid` requires NumPy, whose import alone takes a sizable part of the
+first turn, so it is only used when the `PYWARS_GRID` environment variable is
+set to `on` (or `USE_GRID` is set), and NumPy is imported on the first use.
+Otherwise `get_board_grid` returns None, and callers are expected to fall back
+to iterating over the tiles.
+"""
+from __future__ import annotations
+import collections
+import os
+
+from common_types import Coordinates
+
+from coordinates import PackedBoard, make_coordinates_list
+from profiling import profiled
+
+from tactical_api import TurnContext
+from turn_state import TurnDiff, get_turn_diff, get_turn_snapshot
+
+GRID_ENV = 'PYWARS_GRID'
+ENABLED = 'on'
+# Whether to use `BoardGrid`, None to decide by the environment.
+USE_GRID = None
+
+NO_COUNTRY = 0
+# Owners for distance maps, besides country names and None.
+ENEMIES = 'enemies'
+NOT_MINE = 'not mine'
+# The distance of tiles from owners that own no tile at all.
+INFINITE_DISTANCE = 1 << 30
+# Above this amount of ownership changes, indexes are rebuilt rather than updated.
+INCREMENTAL_LIMIT = 256
+
+# NumPy, once imported by `_import_numpy` (None if it is not available).
+np = None
+_numpy_imported = False
+_ownership_index = None
+_board_grid = None
+_distance_maps_context = None
+_distance_maps = {}
+# Maps an owner to the (turn, distance map) built for it in the last tracked
+# turn, and holds the (turn, countries, owners array) of the last tracked turn.
+_previous_distance_maps = {}
+_previous_owners = None
+
+
+class OwnershipIndex:
+    """Answers tile ownership queries of a single turn in O(1).
+
+    The tiles of a country are fetched from the context on first use, and kept
+    as a set for the rest of the turn. When the turn is tracked, the territories
+    of its snapshot (see `turn_state.TurnSnapshot`) are used instead.
+    """
+
+    def __init__(self, context: TurnContext):
+        self.context = context
+        self.my_country = context.my_country
+        self._territories: dict[None | str, set[Coordinates]] = {}
+
+    def in_bounds(self, coordinates: Coordinates) -> bool:
+        """Returns True iff the given coordinates are inside the game board."""
+        return (0 <= coordinates[0] < self.context.game_width and
+                0 <= coordinates[1] < self.context.game_height)
+
+    def tiles_of(self, country: None | str) -> set[Coordinates]:
+        """Returns the set of tile coordinates owned by the given country.
+
+        If country is None, the returned coordinates are of tiles that do not
+        belong to any country.
+        """
+        territory = self._territories.get(country)
+        if territory is None:
+            territory = _snapshot_territories(self.context).get(country)
+            if territory is None:
+                territory = set(self.context.get_tiles_of_country(country))
+            self._territories[country] = territory
+        return territory
+
+    def owner(self, coordinates: Coordinates) -> None | str:
+        """Returns the name of the country owning the given tile.
+
+        None is returned for tiles that do not belong to any country, and for
+        coordinates outside of the game board.
+        """
+        tile = self.context.tiles.get((coordinates[0], coordinates[1]))
+        return None if tile is None else tile.country
+
+    def is_mine(self, coordinates: Coordinates) -> bool:
+        """Returns True iff the given tile is owned by my country."""
+        return (coordinates[0], coordinates[1]) in self.tiles_of(self.my_country)
+
+
+def _snapshot_territories(context: TurnContext) -> dict[str, set[Coordinates]]:
+    """Returns the territories copied by the snapshot of the turn, if it is tracked."""
+    snapshot = get_turn_snapshot(context)
+    return {} if snapshot is None else snapshot.territories
+
+
+def get_ownership_index(context: TurnContext) -> OwnershipIndex:
+    """Returns the ownership index of the given turn, building it if needed."""
+    global _ownership_index
+    if _ownership_index is None or _ownership_index.context is not context:
+        _ownership_index = OwnershipIndex(context)
+    return _ownership_index
+
+
+class BoardGrid:
+    """An array view of `TurnContext.tiles`.
+
+    All the arrays are indexed by `[x, y]`. The layers are built lazily, on
+    their first use in the turn:
+    * owners: The ID of the country owning each tile (see `country_ids`), or
+              `NO_COUNTRY` for tiles that do not belong to any country.
+    * money: The amount of money in each tile, or 0 if it is unknown.
+    * money_known: A boolean mask of the tiles whose money is known.
+    * my_pieces / enemy_pieces: Maps piece type to the amount of pieces of this
+                                type on each tile.
+    """
+
+    @profiled(name='BoardGrid')
+    def __init__(self, context: TurnContext):
+        self.context = context
+        self.width = context.game_width
+        self.height = context.game_height
+        self.countries = [None] + [country for country in context.all_countries
+                                   if country is not None]
+        self.country_ids = {country: i for i, country in enumerate(self.countries)}
+        self.my_country_id = self.country_ids[context.my_country]
+        self._owners = None
+        self._money = None
+        self._money_known = None
+        self._my_pieces = None
+        self._enemy_pieces = None
+
+    @property
+    def owners(self):
+        if self._owners is None:
+            self._owners = self._build_owners()
+        return self._owners
+
+    def _build_owners(self):
+        global _previous_owners
+        diff = get_turn_diff(self.context)
+        if (diff is not None and not diff.full and _previous_owners is not None and
+                _previous_owners[:2] == (diff.turn - 1, self.countries) and
+                len(diff.owners) <= INCREMENTAL_LIMIT):
+            owners = _previous_owners[2].copy()
+            for (x, y), (_, country) in diff.owners.items():
+                owners[x, y] = self.country_ids.get(country, NO_COUNTRY)
+        else:
+            owners = np.full((self.width, self.height), NO_COUNTRY, dtype=np.int16)
+            territories = _snapshot_territories(self.context)
+            for country_id, country in enumerate(self.countries):
+                if country is None:
+                    continue
+                territory = territories.get(country)
+                if territory is None:
+                    territory = self.context.get_tiles_of_country(country)
+                xs, ys = _to_arrays(territory)
+                owners[xs, ys] = country_id
+        if diff is not None:
+            _previous_owners = (diff.turn, self.countries, owners)
+        return owners
+
+    @property
+    def money(self):
+        if self._money is None:
+            self._build_money()
+        return self._money
+
+    @property
+    def money_known(self):
+        if self._money_known is None:
+            self._build_money()
+        return self._money_known
+
+    @property
+    def my_pieces(self) -> dict[str, np.ndarray]:
+        if self._my_pieces is None:
+            self._build_pieces()
+        return self._my_pieces
+
+    @property
+    def enemy_pieces(self) -> dict[str, np.ndarray]:
+        if self._enemy_pieces is None:
+            self._build_pieces()
+        return self._enemy_pieces
+
+    def _build_money(self):
+        self._money = np.zeros((self.width, self.height), dtype=np.int64)
+        self._money_known = np.zeros((self.width, self.height), dtype=bool)
+        for (x, y), tile in self.context.tiles.items():
+            if tile.money is not None:
+                self._money[x, y] = tile.money
+                self._money_known[x, y] = True
+
+    def _build_pieces(self):
+        self._my_pieces = {}
+        self._enemy_pieces = {}
+        my_country = self.context.my_country
+        for piece in self.context.all_pieces.values():
+            layers = self._my_pieces if piece.country == my_country else self._enemy_pieces
+            layer = layers.get(piece.type)
+            if layer is None:
+                layer = layers[piece.type] = np.zeros((self.width, self.height), dtype=np.int32)
+            x, y = piece.tile.coordinates
+            layer[x, y] += 1
+
+    def piece_count(self, piece_type: str, mine: bool = True):
+        """Returns the layer of the amount of pieces of the given type per tile."""
+        layers = self.my_pieces if mine else self.enemy_pieces
+        layer = layers.get(piece_type)
+        if layer is None:
+            layer = np.zeros((self.width, self.height), dtype=np.int32)
+        return layer
+
+    def owned_by(self, country: None | str):
+        """Returns a boolean mask of the tiles owned by the given country."""
+        return self.owners == self.country_ids.get(country, -1)
+
+    @staticmethod
+    def coordinates(mask, rng=None) -> list[Coordinates]:
+        """Returns the coordinates of the tiles set in the given boolean mask.
+
+        The coordinates are sorted by x and then by y, unless a NumPy random
+        generator is given, in which case they are shuffled using it.
+        """
+        xs, ys = np.nonzero(mask)
+        if rng is not None:
+            order = rng.permutation(len(xs))
+            xs, ys = xs[order], ys[order]
+        return make_coordinates_list(xs.tolist(), ys.tolist())
+
+
+def _to_arrays(coordinates):
+    count = len(coordinates)
+    xs = np.fromiter((c[0] for c in coordinates), dtype=np.intp, count=count)
+    ys = np.fromiter((c[1] for c in coordinates), dtype=np.intp, count=count)
+    return xs, ys
+
+
+def _import_numpy() -> bool:
+    """Imports NumPy on the first call, and returns whether it is available."""
+    global np, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy as np
+        except ImportError:
+            np = None
+    return np is not None
+
+
+def get_board_grid(context: TurnContext) -> None | BoardGrid:
+    """Returns the board grid of the given turn, building it if needed.
+
+    Returns None if the grid is not enabled, or if NumPy is not available.
+    """
+    global _board_grid
+    use_grid = USE_GRID if USE_GRID is not None else os.environ.get(GRID_ENV) == ENABLED
+    if not use_grid or not _import_numpy():
+        return None
+    if _board_grid is None or _board_grid.context is not context:
+        _board_grid = BoardGrid(context)
+    return _board_grid
+
+
+class DistanceMap:
+    """The L1 distance of every tile from the nearest tile of a certain owner.
+
+    Tiles of the owner itself have a distance of 0. If the owner has no tiles at
+    all, every tile has a distance of `INFINITE_DISTANCE`.
+    With NumPy, the full distance array is computed by separable 1D transforms
+    and exposed as `array` (indexed by `[x, y]`). Otherwise, a multi-source BFS
+    is used and `array` is None.
+    """
+
+    @profiled(name='DistanceMap')
+    def __init__(self, context: TurnContext, owner, previous: None | DistanceMap = None,
+                 gained: None | set[Coordinates] = None):
+        self.context = context
+        self.owner = owner
+        self.width = context.game_width
+        self.height = context.game_height
+        self.packed_board = PackedBoard(self.width, self.height)
+        self.array = None
+        self._distances = None
+        if previous is not None:
+            # The owner has only gained tiles, so distances may only decrease.
+            if previous.array is not None:
+                self.array = previous.array.copy()
+                _relax(self.array.reshape(-1), self.packed_board, gained)
+            else:
+                self._distances = list(previous._distances)
+                _relax(self._distances, self.packed_board, gained)
+            return
+        grid = get_board_grid(context)
+        if grid is not None:
+            self.array = _l1_distance_transform(_owner_mask(grid, owner))
+        else:
+            self._distances = [INFINITE_DISTANCE] * self.packed_board.size
+            _relax(self._distances, self.packed_board,
+                   _owner_tiles(get_ownership_index(context), owner))
+
+    def distance(self, coordinates: Coordinates) -> int:
+        """Returns the distance of the given tile from the nearest tile of the owner."""
+        x, y = coordinates[0], coordinates[1]
+        if self.array is not None:
+            return int(self.array[x, y])
+        return self._distances[self.packed_board.pack((x, y))]
+
+
+def _relax(distances, packed_board: PackedBoard, sources):
+    """Sets the distance of the sources to 0, and lowers the distances around them.
+
+    `distances` is a flat sequence, indexed by packed coordinates, and is
+    updated in place by a BFS that stops wherever the distances are already low
+    enough.
+    """
+    queue = collections.deque()
+    for source in packed_board.pack_all(sources):
+        distances[source] = 0
+        queue.append(source)
+    neighbors = packed_board.neighbors
+    while queue:
+        packed = queue.popleft()
+        d = distances[packed] + 1
+        for neighbor in neighbors(packed):
+            if distances[neighbor] > d:
+                distances[neighbor] = d
+                queue.append(neighbor)
+
+
+def _is_owner(owner, country: None | str, my_country: str) -> bool:
+    if owner == ENEMIES:
+        return country is not None and country != my_country
+    if owner == NOT_MINE:
+        return country != my_country
+    return country == owner
+
+
+def _update_distance_map(context: TurnContext, previous: DistanceMap, diff: TurnDiff) -> None | DistanceMap:
+    """Updates the distance map of the previous turn by the given diff.
+
+    Returns None if the map should be rebuilt instead, that is if the owner has
+    lost tiles, or if too many tiles have changed.
+    """
+    if len(diff.owners) > INCREMENTAL_LIMIT:
+        return None
+    my_country = context.my_country
+    gained = set()
+    for coordinates, (old, new) in diff.owners.items():
+        was_owner = _is_owner(previous.owner, old, my_country)
+        is_owner = _is_owner(previous.owner, new, my_country)
+        if was_owner and not is_owner:
+            return None
+        if is_owner and not was_owner:
+            gained.add(coordinates)
+    return DistanceMap(context, previous.owner, previous, gained)
+
+
+def _owner_tiles(index: OwnershipIndex, owner) -> set[Coordinates]:
+    if owner not in (ENEMIES, NOT_MINE):
+        return index.tiles_of(owner)
+    tiles = set()
+    for country in index.context.all_countries:
+        if country != index.my_country:
+            tiles |= index.tiles_of(country)
+    if owner == NOT_MINE:
+        tiles |= index.tiles_of(None)
+    return tiles
+
+
+def _owner_mask(grid: BoardGrid, owner):
+    if owner == ENEMIES:
+        return (grid.owners != grid.my_country_id) & (grid.owners != NO_COUNTRY)
+    if owner == NOT_MINE:
+        return grid.owners != grid.my_country_id
+    return grid.owned_by(owner)
+
+
+def _l1_distance_transform(mask):
+    """Returns the L1 distance of each cell from the nearest set cell of mask."""
+    distances = np.where(mask, 0, INFINITE_DISTANCE).astype(np.int64)
+    for axis in (0, 1):
+        shape = [1, 1]
+        shape[axis] = distances.shape[axis]
+        index = np.arange(distances.shape[axis]).reshape(shape)
+        # min over j <= i of (d[j] + i - j), and then min over j >= i of (d[j] + j - i).
+        forward = np.minimum.accumulate(distances - index, axis=axis) + index
+        backward = np.flip(np.minimum.accumulate(np.flip(distances + index, axis), axis=axis), axis) - index
+        distances = np.minimum(forward, backward)
+    return np.minimum(distances, INFINITE_DISTANCE)
+
+
+def get_distance_map(context: TurnContext, owner) -> DistanceMap:
+    """Returns the distance map from the tiles of the given owner in this turn.
+
+    `owner` is a country name, None for unclaimed tiles, `ENEMIES` for tiles of
+    any other country, or `NOT_MINE` for all tiles not owned by my country.
+
+    If the turn is tracked (see `turn_state.track_turn`) and the map was built
+    in the previous turn as well, it is updated by the ownership changes instead
+    of being rebuilt.
+    """
+    global _distance_maps_context
+    if _distance_maps_context is not context:
+        _distance_maps_context = context
+        _distance_maps.clear()
+    distance_map = _distance_maps.get(owner)
+    if distance_map is not None:
+        return distance_map
+
+    diff = get_turn_diff(context)
+    previous_turn, previous = _previous_distance_maps.get(owner, (None, None))
+    if diff is not None and not diff.full and previous_turn == diff.turn - 1:
+        distance_map = _update_distance_map(context, previous, diff)
+    if distance_map is None:
+        distance_map = DistanceMap(context, owner)
+    _distance_maps[owner] = distance_map
+    if diff is not None:
+        _previous_distance_maps[owner] = (diff.turn, distance_map)
+    return distance_map
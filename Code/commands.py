@@ -0,0 +1,207 @@
+"""Registry of the commands given to the pieces of my country.
+
+Each piece executes at most one command at a time. In-flight commands are
+indexed by their ID, by the piece executing them and by their type, so that
+status reports and per-turn advancing never scan all the commands ever given.
+Finished (successful or failed) commands are moved into a bounded history, so
+their status can still be reported for a while, without the memory growing
+over a long game.
+
+`CommandRegistry.tick` is expected to be called once at the beginning of every
+turn. It advances the elapsed turns of all the in-flight commands, and updates
+their estimates of the remaining turns from the current state of the game.
+Commands whose estimate has not improved for `STALL_TURNS` turns are marked as
+stalled, so the strategic code may give their pieces something better to do.
+"""
+from __future__ import annotations
+import collections
+
+from strategic_api import CommandStatus
+
+ATTACK = 'attack'
+BUILD = 'build'
+COLLECT = 'collect'
+
+IN_PROGRESS = 'in progress'
+SUCCESS = 'success'
+FAILED = 'failed'
+
+# The amount of finished commands whose status is kept.
+HISTORY_SIZE = 1024
+# The amount of turns without progress, after which a command is stalled.
+STALL_TURNS = 10
+
+_registry = None
+
+
+class Command:
+    """A command given to a single piece.
+
+    This class exports the following fields:
+    * id: The command ID, as returned to the strategic code.
+    * type: The type of the command (`ATTACK`, `BUILD` or `COLLECT`).
+    * piece_id: The ID of the piece executing the command.
+    * state: `IN_PROGRESS`, `SUCCESS` or `FAILED`.
+    * status: The last reported `CommandStatus` of the command.
+    * data: A dict of the command arguments (such as its destination).
+    * issued_turn: The turn in which the command has been given.
+    * remaining_turns: The last estimate of the turns left until completion.
+    * best_remaining_turns: The lowest estimate seen by `CommandRegistry.tick`
+                            so far, or None before the first one. The
+                            estimate given when issuing the command is not
+                            counted, as it may be on a different scale.
+    * progress_turn: The last turn in which the estimate has improved.
+    * stalled: True iff the command has not progressed for `STALL_TURNS` turns.
+    """
+
+    __slots__ = ('id', 'type', 'piece_id', 'state', 'status', 'data', 'issued_turn',
+                 'remaining_turns', 'best_remaining_turns', 'progress_turn', 'stalled')
+
+    def __init__(self, command_id: str, command_type: str, piece_id: str, data: dict,
+                 turn: int, estimated_turns: int):
+        self.id = command_id
+        self.type = command_type
+        self.piece_id = piece_id
+        self.state = IN_PROGRESS
+        self.status = None
+        self.data = data
+        self.issued_turn = turn
+        self.remaining_turns = estimated_turns
+        self.best_remaining_turns = None
+        self.progress_turn = turn
+        self.stalled = False
+
+
+class CommandRegistry:
+    """In-flight commands, indexed for O(1) lookups, and a bounded history.
+
+    `on_success`, if set, is called with every command that succeeds.
+    """
+
+    def __init__(self, history_size: int = HISTORY_SIZE):
+        self.history_size = history_size
+        self.on_success = None
+        self.turn = 0
+        self._next_id = 0
+        self._active: dict[str, Command] = {}
+        self._by_piece: dict[str, Command] = {}
+        self._by_type: dict[str, dict[str, Command]] = collections.defaultdict(dict)
+        self._history: collections.OrderedDict[str, Command] = collections.OrderedDict()
+        self._by_state: dict[str, dict[str, Command]] = collections.defaultdict(dict)
+        self._stalled: dict[str, Command] = {}
+
+    def __len__(self):
+        """Returns the amount of in-flight commands."""
+        return len(self._active)
+
+    def issue(self, command_type: str, piece_id: str, estimated_turns: int, **data) -> Command:
+        """Gives a new command to the piece, failing its previous command."""
+        previous = self._by_piece.get(piece_id)
+        if previous is not None:
+            self.fail(previous)
+        command = Command(str(self._next_id), command_type, piece_id, data, self.turn, estimated_turns)
+        self._next_id += 1
+        command.status = CommandStatus.in_progress(command.id, 0, estimated_turns)
+        self._active[command.id] = command
+        self._by_piece[piece_id] = command
+        self._by_type[command_type][command.id] = command
+        self._by_state[IN_PROGRESS][command.id] = command
+        return command
+
+    def get(self, command_id: str) -> None | Command:
+        """Returns the command of the given ID, if it is in flight or in the history."""
+        command = self._active.get(command_id)
+        if command is None:
+            command = self._history.get(command_id)
+        return command
+
+    def status(self, command_id: str) -> None | CommandStatus:
+        """Returns the last status of the command, or None if it is unknown."""
+        command = self.get(command_id)
+        return None if command is None else command.status
+
+    def of_piece(self, piece_id: str) -> None | Command:
+        """Returns the in-flight command of the piece, if any."""
+        return self._by_piece.get(piece_id)
+
+    def of_type(self, command_type: str) -> list[Command]:
+        """Returns the in-flight commands of the given type.
+
+        A list is returned, so commands may be finished while iterating it.
+        """
+        return list(self._by_type[command_type].values())
+
+    def in_state(self, state: str) -> list[Command]:
+        """Returns the known commands (in flight or in the history) in the given state."""
+        return list(self._by_state[state].values())
+
+    def stalled(self) -> list[Command]:
+        """Returns the in-flight commands that have stalled."""
+        return list(self._stalled.values())
+
+    def tick(self, turn: int, estimate):
+        """Advances all the in-flight commands to the given turn.
+
+        `estimate` is called with each in-flight command, and should return the
+        estimated amount of turns left until its completion, or None if it can
+        not be estimated (in which case the previous estimate is kept).
+        Calling this method again with the same turn does nothing.
+        """
+        if turn == self.turn:
+            return
+        self.turn = turn
+        for command in list(self._active.values()):
+            remaining = estimate(command)
+            if remaining is not None:
+                command.remaining_turns = remaining
+                if command.best_remaining_turns is None or remaining < command.best_remaining_turns:
+                    command.best_remaining_turns = remaining
+                    command.progress_turn = turn
+            self.progress(command, command.remaining_turns)
+            command.stalled = turn - command.progress_turn >= STALL_TURNS
+            if command.stalled:
+                self._stalled[command.id] = command
+            else:
+                self._stalled.pop(command.id, None)
+
+    def progress(self, command: Command, remaining_turns: int):
+        """Updates the status of an in-flight command with a new estimate."""
+        command.remaining_turns = remaining_turns
+        elapsed_turns = self.turn - command.issued_turn
+        command.status = CommandStatus.in_progress(command.id, elapsed_turns, elapsed_turns + remaining_turns)
+
+    def succeed(self, command: Command):
+        """Marks the command as successful, and moves it into the history."""
+        if self._finish(command, SUCCESS, CommandStatus.success(command.id)) and self.on_success is not None:
+            self.on_success(command)
+
+    def fail(self, command: Command):
+        """Marks the command as failed, and moves it into the history."""
+        self._finish(command, FAILED, CommandStatus.failed(command.id))
+
+    def _finish(self, command: Command, state: str, status: CommandStatus) -> bool:
+        """Moves an in-flight command into the history. Returns False if it has already finished."""
+        if self._active.pop(command.id, None) is None:
+            return False
+        if self._by_piece.get(command.piece_id) is command:
+            del self._by_piece[command.piece_id]
+        del self._by_type[command.type][command.id]
+        del self._by_state[IN_PROGRESS][command.id]
+        self._stalled.pop(command.id, None)
+        command.stalled = False
+        command.state = state
+        command.status = status
+        self._by_state[state][command.id] = command
+        self._history[command.id] = command
+        while len(self._history) > self.history_size:
+            _, evicted = self._history.popitem(last=False)
+            del self._by_state[evicted.state][evicted.id]
+        return True
+
+
+def get_command_registry() -> CommandRegistry:
+    """Returns the registry of the commands of this game."""
+    global _registry
+    if _registry is None:
+        _registry = CommandRegistry()
+    return _registry
@@ -0,0 +1,100 @@
+"""Compact representation of board coordinates, for hot loops.
+
+`common_types.Coordinates` is a namedtuple, which is convenient but costly to
+create and to hash in loops over the whole board. `PackedBoard` packs the
+coordinates of a board into plain ints (`x * height + y`, the flat layout of
+the `[x, y]` arrays in `board`), which hash and compare at C speed and index
+flat lists directly.
+
+Packed coordinates are meant for internal loops only. They should be unpacked
+before being handed to the game API, or used as keys into `TurnContext.tiles`.
+"""
+from __future__ import annotations
+import functools
+import sys
+
+from common_types import Coordinates
+
+# Creating namedtuples through `tuple.__new__` skips the argument parsing of
+# `Coordinates.__new__`, which dominates the creation of whole-board lists.
+_new_coordinates = functools.partial(tuple.__new__, Coordinates)
+
+
+def make_coordinates(x: int, y: int) -> Coordinates:
+    """Creates a `Coordinates` object, faster than `Coordinates(x, y)`."""
+    return _new_coordinates((x, y))
+
+
+def make_coordinates_list(xs, ys) -> list[Coordinates]:
+    """Creates a list of `Coordinates` objects out of x and y sequences."""
+    return list(map(_new_coordinates, zip(xs, ys)))
+
+
+class PackedBoard:
+    """Packs and unpacks the coordinates of a board of a certain size."""
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+        self.size = width * height
+        self._unpacked: dict[int, Coordinates] = {}
+
+    def pack(self, coordinates: Coordinates) -> int:
+        """Packs coordinates (or any (x, y) tuple) into an int."""
+        return coordinates[0] * self.height + coordinates[1]
+
+    def pack_all(self, coordinates) -> list[int]:
+        height = self.height
+        return [x * height + y for x, y in coordinates]
+
+    def unpack(self, packed: int) -> Coordinates:
+        """Returns the `Coordinates` of the packed int.
+
+        Unpacked coordinates are cached, so each tile is allocated only once.
+        """
+        coordinates = self._unpacked.get(packed)
+        if coordinates is None:
+            coordinates = self._unpacked[packed] = _new_coordinates(divmod(packed, self.height))
+        return coordinates
+
+    def in_bounds(self, coordinates: Coordinates) -> bool:
+        return 0 <= coordinates[0] < self.width and 0 <= coordinates[1] < self.height
+
+    def distance(self, a: int, b: int) -> int:
+        """Returns the L1 distance between two packed coordinates."""
+        ax, ay = divmod(a, self.height)
+        bx, by = divmod(b, self.height)
+        return abs(ax - bx) + abs(ay - by)
+
+    def distances(self, origin: int, packed: list[int]) -> list[int]:
+        """Returns the L1 distances of all the packed coordinates from origin.
+
+        NumPy is used for long lists only if it was already imported (such as
+        by `board.BoardGrid`), as importing it costs more than it saves here.
+        """
+        height = self.height
+        ox, oy = divmod(origin, height)
+        np = sys.modules.get('numpy')
+        if np is not None and len(packed) > 64:
+            xs, ys = np.divmod(np.asarray(packed, dtype=np.int64), height)
+            return (np.abs(xs - ox) + np.abs(ys - oy)).tolist()
+        result = []
+        for p in packed:
+            x, y = divmod(p, height)
+            result.append(abs(x - ox) + abs(y - oy))
+        return result
+
+    def neighbors(self, packed: int) -> list[int]:
+        """Returns the packed coordinates of the (up to 4) adjacent tiles."""
+        height = self.height
+        x, y = divmod(packed, height)
+        result = []
+        if x > 0:
+            result.append(packed - height)
+        if x < self.width - 1:
+            result.append(packed + height)
+        if y > 0:
+            result.append(packed - 1)
+        if y < height - 1:
+            result.append(packed + 1)
+        return result
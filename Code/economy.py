@@ -0,0 +1,100 @@
+"""Routing of builders to the money on the tiles of my country.
+
+`MoneyRouter` keeps a heatmap of the known money on my tiles in a single turn
+(taken from the turn's snapshot, see `turn_state`), and sends each builder to
+the tile with the best rate of money per turn spent, counting both the turns
+of moving there over my land and of collecting the money. Every routed builder
+claims the money it is going for, so builders near each other do not go for
+the same tile in the same turn.
+"""
+from __future__ import annotations
+import collections
+
+from common_types import Coordinates
+
+from board import get_ownership_index
+from coordinates import PackedBoard
+from profiling import profiled
+from tactical_api import TurnContext
+from turn_state import get_turn_snapshot
+
+# The maximal amount of money a builder may collect in a single turn.
+MAX_COLLECT = 5
+# The maximal amount of moves from a builder to the tiles it may be routed to.
+ROUTE_RADIUS = 12
+
+_money_router = None
+
+
+class MoneyRouter:
+    """Chooses where the builders of a single turn collect money."""
+
+    def __init__(self, context: TurnContext):
+        self.context = context
+        self._board = PackedBoard(context.game_width, context.game_height)
+        my_tiles = get_ownership_index(context).tiles_of(context.my_country)
+        self._my_tiles = set(self._board.pack_all(my_tiles))
+        snapshot = get_turn_snapshot(context)
+        if snapshot is not None:
+            money = snapshot.money
+        else:
+            tiles = context.tiles
+            money = {coordinates: tiles[coordinates].money for coordinates in my_tiles
+                     if tiles[coordinates].money is not None}
+        pack = self._board.pack
+        # Maps the packed coordinates of each tile to its money not claimed yet.
+        self.heatmap: dict[int, int] = {pack(coordinates): amount for coordinates, amount in money.items()
+                                        if amount > 0}
+
+    def money(self, coordinates: Coordinates) -> int:
+        """Returns the known money on the tile, which has not been claimed by a builder."""
+        return self.heatmap.get(self._board.pack(coordinates), 0)
+
+    @profiled(name='MoneyRouter.route')
+    def route(self, source: Coordinates, amount: int) -> None | Coordinates:
+        """Returns the tile a builder at source should step into (or stay at) to collect money.
+
+        The builder claims the money it is going to collect, up to `amount`.
+        Returns None if no money is known within `ROUTE_RADIUS` moves.
+        """
+        board = self._board
+        my_tiles = self._my_tiles
+        heatmap = self.heatmap
+        origin = board.pack(source)
+        # Maps each visited tile to the first step towards it, and its distance.
+        first_steps = {origin: origin}
+        queue = collections.deque([(origin, 0)])
+        best = None
+        best_rate = 0.0
+        while queue:
+            packed, distance = queue.popleft()
+            money = heatmap.get(packed, 0)
+            if money > 0:
+                gain = min(money, amount)
+                rate = gain / (distance + -(-gain // MAX_COLLECT))
+                if rate > best_rate:
+                    best, best_rate = packed, rate
+            if distance == ROUTE_RADIUS:
+                continue
+            first_step = first_steps[packed]
+            for neighbor in board.neighbors(packed):
+                if neighbor in first_steps or neighbor not in my_tiles:
+                    continue
+                first_steps[neighbor] = neighbor if packed == origin else first_step
+                queue.append((neighbor, distance + 1))
+        if best is None:
+            return None
+        gain = min(heatmap[best], amount)
+        if heatmap[best] > gain:
+            heatmap[best] -= gain
+        else:
+            del heatmap[best]
+        return board.unpack(first_steps[best])
+
+
+def get_money_router(context: TurnContext) -> MoneyRouter:
+    """Returns the money router of the given turn, building it if needed."""
+    global _money_router
+    if _money_router is None or _money_router.context is not context:
+        _money_router = MoneyRouter(context)
+    return _money_router
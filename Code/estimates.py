@@ -0,0 +1,138 @@
+"""Online estimates of the amount of turns commands take.
+
+Every successful command is recorded with the key of its features (its type,
+the piece type, and bucketed distances or amounts of money), and the amount of
+turns it actually took. Estimates are the mean duration of the commands of the
+same key, blended with a prior (usually an analytic estimate), so keys with few
+samples still get sensible answers. Both recording and estimating are O(1).
+
+The statistics are kept across games in a small JSON file next to this module,
+or in the file named by the `PYWARS_ESTIMATES` environment variable. Setting
+it to `off` keeps the statistics in memory only (the simulator does so, so
+simulated games never overwrite the real statistics). The file is written
+every `SAVE_INTERVAL` turns, and when the process exits at the end of the
+game. Failing to read or write it (e.g. on a read-only file system) is not an
+error, the estimator just starts from scratch.
+"""
+from __future__ import annotations
+import atexit
+import json
+import os
+
+ESTIMATES_FILENAME = 'turn_estimates.json'
+ESTIMATES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ESTIMATES_FILENAME)
+ESTIMATES_ENV = 'PYWARS_ESTIMATES'
+DISABLED = 'off'
+# The weight of the prior, in samples.
+PRIOR_WEIGHT = 2
+# Values up to this limit get buckets of their own, larger ones are bucketed by
+# powers of 2.
+EXACT_BUCKETS = 8
+# The minimal amount of turns between writes of the statistics file.
+SAVE_INTERVAL = 25
+
+_estimator = None
+
+
+def bucket(value: int) -> int:
+    """Returns the bucket of a non-negative int feature."""
+    value = max(int(value), 0)
+    if value < EXACT_BUCKETS:
+        return value
+    return 1 << (value.bit_length() - 1)
+
+
+def movement_key(command_type: str, piece_type: str, distance: int, radius: int) -> tuple:
+    """Returns the key of a command that moves a piece towards a destination."""
+    return command_type, piece_type, bucket(distance - radius)
+
+
+def build_key(piece_type: str, missing_money: int) -> tuple:
+    """Returns the key of a build command."""
+    return 'build', piece_type, bucket(missing_money)
+
+
+def collect_key(amount: int, tile_money: int) -> tuple:
+    """Returns the key of a money collection command."""
+    return 'collect', bucket(amount), bucket(tile_money)
+
+
+class TurnEstimator:
+    """Running means of the durations of commands, by their keys."""
+
+    def __init__(self, path: None | str = ESTIMATES_PATH):
+        self.path = path
+        # Maps a key (joined into a str) to [amount of samples, total turns].
+        self.stats: dict[str, list[int]] = {}
+        self.dirty = False
+        self.last_save_turn = 0
+        self.load()
+
+    @staticmethod
+    def _key(key: tuple) -> str:
+        return '|'.join(map(str, key))
+
+    def load(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path) as estimates_file:
+                stats = json.load(estimates_file)
+        except (OSError, ValueError):
+            return
+        if isinstance(stats, dict):
+            self.stats = {key: [int(value[0]), int(value[1])] for key, value in stats.items()}
+
+    def save(self):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'w') as estimates_file:
+                json.dump(self.stats, estimates_file)
+        except OSError:
+            return
+        self.dirty = False
+
+    def save_if_dirty(self):
+        if self.dirty:
+            self.save()
+
+    def save_if_needed(self, turn: int):
+        """Writes the statistics, if they have changed in the last `SAVE_INTERVAL` turns."""
+        if self.dirty and turn - self.last_save_turn >= SAVE_INTERVAL:
+            self.last_save_turn = turn
+            self.save()
+
+    def record(self, key: tuple, turns: int):
+        """Records a command of the given key, that has been completed in `turns` turns."""
+        stats = self.stats.setdefault(self._key(key), [0, 0])
+        stats[0] += 1
+        stats[1] += turns
+        self.dirty = True
+
+    def estimate(self, key: tuple, prior: float) -> int:
+        """Returns the estimated amount of turns of a command of the given key."""
+        count, total = self.stats.get(self._key(key), (0, 0))
+        return round((total + prior * PRIOR_WEIGHT) / (count + PRIOR_WEIGHT))
+
+
+def get_estimates_path() -> None | str:
+    """Returns the path of the statistics file, or None if they should not be kept."""
+    path = os.environ.get(ESTIMATES_ENV)
+    if path is None:
+        return ESTIMATES_PATH
+    if not path or path == DISABLED:
+        return None
+    return path
+
+
+def get_turn_estimator() -> TurnEstimator:
+    """Returns the estimator of this process, loading its statistics if needed.
+
+    Its last statistics are saved when the process exits.
+    """
+    global _estimator
+    if _estimator is None:
+        _estimator = TurnEstimator(get_estimates_path())
+        atexit.register(_estimator.save_if_dirty)
+    return _estimator
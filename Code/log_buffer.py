@@ -0,0 +1,161 @@
+"""Buffered, batched logging.
+
+Every `TurnContext.log` call may be a request to the game server, so logging a
+few lines per piece slows the turn down. `BufferedLogger` collects the entries
+in memory, and writes them as one multi-line entry when the turn ends or when
+the buffer grows over its limits. Sinks are written synchronously, so the
+turn's context is only called from the turn's own thread and before the turn
+ends. Slow local sinks (such as files) may be given as background sinks,
+which are written by a background thread so the turn never waits for them;
+if threads are not available, they are written synchronously too. Batches
+still queued when the process exits are written before it exits. Errors while
+writing logs are ignored, logging should never break a turn.
+
+`get_turn_log` returns the logger of the current turn, which writes to the log
+of the turn's context, and also appends to the file named by the
+`PYWARS_LOG_FILE` environment variable (in the background), if it is set.
+"""
+from __future__ import annotations
+import atexit
+import os
+import queue
+import threading
+
+from tactical_api import TurnContext
+
+LOG_FILE_ENV = 'PYWARS_LOG_FILE'
+MAX_ENTRIES = 200
+MAX_BYTES = 16 * 1024
+# The maximal amount of seconds to wait for queued batches when exiting.
+EXIT_TIMEOUT = 1.0
+
+_writer = None
+_turn_log = None
+
+
+class _Writer:
+    """A background thread, which calls sinks with batches of entries."""
+
+    def __init__(self):
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name='log writer', daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            sink, batch = self.queue.get()
+            if sink is None:
+                batch.set()
+                continue
+            _write(sink, batch)
+
+    def write(self, sink, batch: str):
+        self.queue.put((sink, batch))
+
+    def drain(self, timeout: float):
+        """Waits until all the batches queued so far are written."""
+        done = threading.Event()
+        self.queue.put((None, done))
+        done.wait(timeout)
+
+
+def _write(sink, batch: str):
+    try:
+        sink(batch)
+    except Exception:
+        pass
+
+
+def _get_writer() -> None | _Writer:
+    """Returns the background writer, or None if threads can not be started."""
+    global _writer
+    if _writer is None:
+        try:
+            _writer = _Writer()
+        except RuntimeError:
+            return None
+        atexit.register(_writer.drain, EXIT_TIMEOUT)
+    return _writer
+
+
+def file_sink(path: str):
+    """Returns a sink, which appends batches to the file at the given path."""
+    def write(batch: str):
+        with open(path, 'a') as log_file:
+            log_file.write(batch + '\n')
+    return write
+
+
+class BufferedLogger:
+    """Collects log entries, and writes them to sinks in batches.
+
+    `sinks` are callables, each called with every batch of entries joined by
+    new lines (as a single str, without a trailing new line). `sinks` are
+    called synchronously, and `background_sinks` by the background thread.
+    `context` is the turn the logger belongs to, if any.
+    """
+
+    def __init__(self, sinks, background_sinks=(), max_entries: int = MAX_ENTRIES,
+                 max_bytes: int = MAX_BYTES):
+        self.sinks = list(sinks)
+        self.background_sinks = list(background_sinks)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.context = None
+        self._entries: list[str] = []
+        self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def log(self, log_entry: str):
+        self._entries.append(log_entry)
+        self._size += len(log_entry) + 1
+        if len(self._entries) >= self.max_entries or self._size >= self.max_bytes:
+            self.flush()
+
+    def flush(self):
+        """Writes all the buffered entries as a single batch."""
+        if not self._entries:
+            return
+        batch = '\n'.join(self._entries)
+        self._entries = []
+        self._size = 0
+        for sink in self.sinks:
+            _write(sink, batch)
+        if self.background_sinks:
+            writer = _get_writer()
+            for sink in self.background_sinks:
+                if writer is None:
+                    _write(sink, batch)
+                else:
+                    writer.write(sink, batch)
+
+    def take_entries(self) -> list[str]:
+        """Removes the buffered entries, and returns them."""
+        entries = self._entries
+        self._entries = []
+        self._size = 0
+        return entries
+
+
+def get_turn_log(context: TurnContext) -> BufferedLogger:
+    """Returns the buffered logger of the given turn.
+
+    Entries left over from the previous turn (logged after it has been flushed)
+    are moved to this turn's log, as the previous context may no longer be used.
+    """
+    global _turn_log
+    if _turn_log is None or _turn_log.context is not context:
+        leftovers = [] if _turn_log is None else _turn_log.take_entries()
+        path = os.environ.get(LOG_FILE_ENV)
+        _turn_log = BufferedLogger([context.log], [file_sink(path)] if path else [])
+        _turn_log.context = context
+        for entry in leftovers:
+            _turn_log.log(entry)
+    return _turn_log
+
+
+def current_turn_log() -> None | BufferedLogger:
+    """Returns the buffered logger of the last turn given to `get_turn_log`."""
+    return _turn_log
@@ -0,0 +1,147 @@
+"""Leveled, rate-limited and sampled logging for the bot modules.
+
+Modules get their log using `get_log`, and log through it with a level:
+
+    log = logs.get_log('simple_strategic')
+    log.debug('Attack: %s', command_id)
+
+Messages are formatted (`message % args`) only if they are emitted, so a
+disabled message costs a single level check. Emitted messages go to the
+buffered log of the current turn (see `log_buffer`).
+
+The configuration is read from `log_config.json` next to this module, or from
+the file named by the `PYWARS_LOG_CONFIG` environment variable, so it can be
+changed when uploading the code (see `upload_script.py --log-level`). All its
+fields are optional:
+
+    {
+        "level": "info",                        # The default threshold.
+        "modules": {"simple_strategic": "debug"},  # Per-module thresholds.
+        "rate_limits": {"Attack: %s": 10},      # Max messages per turn, by key.
+        "sampling": {"theta=%s degree": 20}     # Emit 1 of every N, by key.
+    }
+
+The key of a message is its `key` argument, or its (unformatted) message.
+"""
+from __future__ import annotations
+import json
+import os
+
+import log_buffer
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+OFF = 100
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'warn': WARNING, 'off': OFF}
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING'}
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'log_config.json')
+CONFIG_ENV = 'PYWARS_LOG_CONFIG'
+DEFAULT_LEVEL = INFO
+
+_config = None
+_logs = {}
+
+
+class LogConfig:
+    """The thresholds, rate limits and sampling rates of the logs."""
+
+    def __init__(self, level: int = DEFAULT_LEVEL, modules: None | dict[str, int] = None,
+                 rate_limits: None | dict[str, int] = None, sampling: None | dict[str, int] = None):
+        self.level = level
+        self.modules = modules or {}
+        self.rate_limits = rate_limits or {}
+        self.sampling = sampling or {}
+
+    @staticmethod
+    def load(path: str) -> LogConfig:
+        """Loads a configuration file. A missing or invalid file gives the defaults."""
+        try:
+            with open(path) as config_file:
+                data = json.load(config_file)
+            return LogConfig(
+                _parse_level(data.get('level', DEFAULT_LEVEL)),
+                {module: _parse_level(level) for module, level in data.get('modules', {}).items()},
+                {key: int(limit) for key, limit in data.get('rate_limits', {}).items()},
+                {key: max(int(every), 1) for key, every in data.get('sampling', {}).items()},
+            )
+        except (OSError, ValueError, AttributeError, TypeError):
+            return LogConfig()
+
+
+def _parse_level(level) -> int:
+    if isinstance(level, int):
+        return level
+    return LEVELS[level.lower()]
+
+
+class ModuleLog:
+    """The log of a single module."""
+
+    def __init__(self, module: str, config: LogConfig):
+        self.module = module
+        self.config = config
+        self.level = config.modules.get(module, config.level)
+        self._turn_log = None
+        # Maps a key to the amount of its messages in this turn / in total.
+        self._turn_counts: dict[str, int] = {}
+        self._counts: dict[str, int] = {}
+
+    def enabled_for(self, level: int) -> bool:
+        return level >= self.level
+
+    def debug(self, message: str, *args, key: None | str = None):
+        if DEBUG >= self.level:
+            self._emit(DEBUG, message, args, key)
+
+    def info(self, message: str, *args, key: None | str = None):
+        if INFO >= self.level:
+            self._emit(INFO, message, args, key)
+
+    def warning(self, message: str, *args, key: None | str = None):
+        if WARNING >= self.level:
+            self._emit(WARNING, message, args, key)
+
+    def _emit(self, level: int, message: str, args, key: None | str):
+        turn_log = log_buffer.current_turn_log()
+        if turn_log is None:
+            return
+        if key is None:
+            key = message
+        if turn_log is not self._turn_log:
+            self._turn_log = turn_log
+            self._turn_counts.clear()
+
+        limit = self.config.rate_limits.get(key)
+        if limit is not None:
+            turn_count = self._turn_counts.get(key, 0)
+            self._turn_counts[key] = turn_count + 1
+            if turn_count >= limit:
+                return
+        every = self.config.sampling.get(key)
+        if every is not None:
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+            if count % every:
+                return
+
+        if args:
+            message = message % args
+        turn_log.log(f'{LEVEL_NAMES[level]} {self.module}: {message}')
+
+
+def get_config() -> LogConfig:
+    """Returns the logs configuration, loading it if needed."""
+    global _config
+    if _config is None:
+        _config = LogConfig.load(os.environ.get(CONFIG_ENV) or CONFIG_PATH)
+    return _config
+
+
+def get_log(module: str) -> ModuleLog:
+    """Returns the log of the given module."""
+    log = _logs.get(module)
+    if log is None:
+        log = _logs[module] = ModuleLog(module, get_config())
+    return log
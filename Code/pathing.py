@@ -0,0 +1,143 @@
+"""Distance fields for moving pieces across the board.
+
+A distance field holds, for each tile around a destination, the cost of the
+cheapest path from that tile to the destination. Entering a tile of my country
+costs `MOVE_COST` turns, while entering any other tile costs `CONQUER_COST`
+turns (moving into it and attacking it).
+
+Fields are cached for the whole turn, so all the pieces heading to the same
+destination share one field, and each of their steps is an O(1) lookup.
+"""
+from __future__ import annotations
+import heapq
+
+from common_types import Coordinates
+
+from board import get_ownership_index
+from coordinates import PackedBoard
+from profiling import profiled
+from tactical_api import TurnContext
+
+MOVE_COST = 1
+CONQUER_COST = 2
+# Fields cover the bounding box of the destination and the pieces heading to
+# it, expanded by this amount of tiles in each direction.
+FIELD_MARGIN = 2
+DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+_path_finder = None
+
+
+class DistanceField:
+    """Costs of the cheapest paths to a destination, within a bounding box."""
+
+    @profiled(name='DistanceField')
+    def __init__(self, destination: Coordinates, bounds: tuple[int, int, int, int], cost):
+        self.destination = destination
+        self.bounds = bounds
+        x0, y0, x1, y1 = bounds
+        self._height = y1 - y0 + 1
+        # The box is packed on its own, so indices are relative to (x0, y0).
+        self._box = PackedBoard(x1 - x0 + 1, self._height)
+        self._cost = [0] * self._box.size
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+                self._cost[self._index(x, y)] = cost(x, y)
+        self._distances = self._dijkstra()
+
+    def _index(self, x: int, y: int) -> int:
+        return (x - self.bounds[0]) * self._height + (y - self.bounds[1])
+
+    def contains(self, coordinates: Coordinates) -> bool:
+        x0, y0, x1, y1 = self.bounds
+        return x0 <= coordinates[0] <= x1 and y0 <= coordinates[1] <= y1
+
+    def _dijkstra(self):
+        distances = [None] * len(self._cost)
+        start = self._index(*self.destination)
+        distances[start] = 0
+        queue = [(0, start)]
+        neighbors = self._box.neighbors
+        while queue:
+            d, index = heapq.heappop(queue)
+            if d > distances[index]:
+                continue
+            # Stepping from a neighbor into the tile costs the cost of the tile.
+            nd = d + self._cost[index]
+            for neighbor in neighbors(index):
+                if distances[neighbor] is None or nd < distances[neighbor]:
+                    distances[neighbor] = nd
+                    heapq.heappush(queue, (nd, neighbor))
+        return distances
+
+    def distance(self, coordinates: Coordinates) -> int:
+        """Returns the cost of the cheapest path from the coordinates."""
+        return self._distances[self._index(coordinates[0], coordinates[1])]
+
+    def next_step(self, coordinates: Coordinates) -> Coordinates:
+        """Returns the neighbor tile to step into on the cheapest path.
+
+        If the coordinates are the destination itself, they are returned as is.
+        """
+        x, y = coordinates[0], coordinates[1]
+        if (x, y) == (self.destination[0], self.destination[1]):
+            return Coordinates(x, y)
+        best = None
+        best_cost = None
+        for dx, dy in DIRECTIONS:
+            neighbor = Coordinates(x + dx, y + dy)
+            if not self.contains(neighbor):
+                continue
+            index = self._index(x + dx, y + dy)
+            cost = self._cost[index] + self._distances[index]
+            if best_cost is None or cost < best_cost:
+                best, best_cost = neighbor, cost
+        return best
+
+
+class PathFinder:
+    """Builds and caches the distance fields of a single turn."""
+
+    def __init__(self, context: TurnContext):
+        self.context = context
+        self._fields: dict[Coordinates, DistanceField] = {}
+        ownership = get_ownership_index(context)
+        my_tiles = ownership.tiles_of(context.my_country)
+        self._cost = lambda x, y: MOVE_COST if (x, y) in my_tiles else CONQUER_COST
+
+    def clamp(self, coordinates: Coordinates) -> Coordinates:
+        """Returns the nearest coordinates inside the game board."""
+        return Coordinates(min(max(coordinates[0], 0), self.context.game_width - 1),
+                           min(max(coordinates[1], 0), self.context.game_height - 1))
+
+    def field(self, destination: Coordinates, source: Coordinates) -> DistanceField:
+        """Returns a distance field to the destination, covering the source."""
+        destination = self.clamp(destination)
+        field = self._fields.get(destination)
+        if field is not None and field.contains(source):
+            return field
+
+        points = [destination, source]
+        if field is not None:
+            points += [field.bounds[:2], field.bounds[2:]]
+        bounds = (
+            max(min(point[0] for point in points) - FIELD_MARGIN, 0),
+            max(min(point[1] for point in points) - FIELD_MARGIN, 0),
+            min(max(point[0] for point in points) + FIELD_MARGIN, self.context.game_width - 1),
+            min(max(point[1] for point in points) + FIELD_MARGIN, self.context.game_height - 1),
+        )
+        field = DistanceField(destination, bounds, self._cost)
+        self._fields[destination] = field
+        return field
+
+    def next_step(self, source: Coordinates, destination: Coordinates) -> Coordinates:
+        """Returns the tile to step into when going from source to destination."""
+        return self.field(destination, source).next_step(source)
+
+
+def get_path_finder(context: TurnContext) -> PathFinder:
+    """Returns the path finder of the given turn, building it if needed."""
+    global _path_finder
+    if _path_finder is None or _path_finder.context is not context:
+        _path_finder = PathFinder(context)
+    return _path_finder
@@ -0,0 +1,170 @@
+"""Lightweight per-turn profiling of the bot code.
+
+Functions decorated with `profiled`, and blocks wrapped by `section`, record
+their call counts, wall time and (optionally) the change in traced memory.
+`flush` is expected to be called at the end of every turn. It emits a one-line
+summary of the turn, through the turn's log and/or into a local file, and
+resets the statistics.
+
+Profiling is disabled by default. When disabled, a profiled function costs one
+extra check per call, and `section` returns a shared no-op context manager.
+It may be enabled by calling `enable`, or by setting the `PYWARS_PROFILE`
+environment variable to `log`, or to the path of a file to append summaries
+to. Setting `PYWARS_PROFILE_ALLOCATIONS` to a non-empty value also traces
+allocations, which is much slower.
+"""
+from __future__ import annotations
+import contextlib
+import functools
+import os
+import time
+import tracemalloc
+
+PROFILE_ENV = 'PYWARS_PROFILE'
+ALLOCATIONS_ENV = 'PYWARS_PROFILE_ALLOCATIONS'
+LOG_OUTPUT = 'log'
+
+_enabled = False
+_allocations = False
+_log = False
+_path = None
+_turn = 0
+# Maps a name to [calls, seconds, allocated bytes].
+_stats: dict[str, list] = {}
+_null_section = contextlib.nullcontext()
+
+
+def enable(log: bool = True, path: None | str = None, allocations: bool = False):
+    """Enables profiling.
+
+    Summaries are logged through the turn's log if `log` is True, and are
+    appended to the file at `path` if it is given.
+    """
+    global _enabled, _allocations, _log, _path
+    _enabled = True
+    _log = log
+    _path = path
+    _allocations = allocations
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    _stats.clear()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def _memory() -> int:
+    return tracemalloc.get_traced_memory()[0] if _allocations else 0
+
+
+def _record(name: str, elapsed: float, allocated: int):
+    stats = _stats.get(name)
+    if stats is None:
+        _stats[name] = [1, elapsed, allocated]
+    else:
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += allocated
+
+
+class _Section:
+    """Records the block it wraps under a name."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.memory = _memory()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        _record(self.name, time.perf_counter() - self.start, _memory() - self.memory)
+
+
+def section(name: str):
+    """Returns a context manager recording the block it wraps under the name."""
+    if not _enabled:
+        return _null_section
+    return _Section(name)
+
+
+def profiled(func=None, *, name: None | str = None):
+    """Decorates a function, so its calls are recorded while profiling is enabled.
+
+    May be used as `@profiled` or as `@profiled(name='...')`. The default name
+    is the qualified name of the function.
+    """
+    if func is None:
+        return functools.partial(profiled, name=name)
+    name = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        memory = _memory()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _record(name, time.perf_counter() - start, _memory() - memory)
+
+    return wrapper
+
+
+def summary() -> str:
+    """Returns a one-line summary of the statistics, slowest first."""
+    entries = sorted(_stats.items(), key=lambda item: item[1][1], reverse=True)
+    parts = []
+    for name, (calls, seconds, allocated) in entries:
+        part = f'{name} {calls}x {seconds * 1000:.2f}ms'
+        if _allocations:
+            part += f' {allocated / 1024:+.1f}KB'
+        parts.append(part)
+    return '; '.join(parts)
+
+
+def flush(logger=None):
+    """Emits the summary of the turn, and resets the statistics.
+
+    `logger` is anything with a `log` method, such as a `TurnContext` or a
+    `StrategicApi`. Does nothing if profiling is disabled, or nothing has been
+    recorded.
+    """
+    global _turn
+    if not _enabled:
+        return
+    _turn += 1
+    if not _stats:
+        return
+    line = f'profile turn {_turn}: {summary()}'
+    _stats.clear()
+    if _log and logger is not None:
+        logger.log(line)
+    if _path is not None:
+        try:
+            with open(_path, 'a') as profile_file:
+                profile_file.write(line + '\n')
+        except OSError:
+            pass
+
+
+def _enable_from_environment():
+    output = os.environ.get(PROFILE_ENV)
+    if not output:
+        return
+    allocations = bool(os.environ.get(ALLOCATIONS_ENV))
+    if output == LOG_OUTPUT:
+        enable(log=True, allocations=allocations)
+    else:
+        enable(log=False, path=output, allocations=allocations)
+
+
+_enable_from_environment()
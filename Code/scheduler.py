@@ -0,0 +1,95 @@
+"""Time-budgeted scheduling of the phases of a turn.
+
+A turn is split into phases (such as economy and attack), which run in
+priority order. Each phase gets a share of the time left in the turn, so time
+saved by fast phases goes to the following ones. Phases are generator
+functions, which yield after every unit of work (usually after issuing a
+command). When a phase runs out of time it is closed at its next yield, so all
+the commands issued up to that point are kept.
+"""
+from __future__ import annotations
+import time
+
+from profiling import section
+
+
+class Budget:
+    """The time budget of a single phase."""
+
+    def __init__(self, deadline: float, clock=time.perf_counter):
+        self.deadline = deadline
+        self.clock = clock
+
+    def remaining(self) -> float:
+        """Returns the amount of seconds left, which may be 0."""
+        return max(self.deadline - self.clock(), 0.0)
+
+    def expired(self) -> bool:
+        return self.clock() >= self.deadline
+
+
+class PhaseReport:
+    """The outcome of running a phase.
+
+    This class exports the following fields:
+    * name: The name of the phase.
+    * elapsed: The amount of seconds the phase has taken.
+    * units: The amount of units of work the phase has yielded.
+    * completed: False iff the phase has been stopped by its budget.
+    """
+
+    def __init__(self, name: str, elapsed: float, units: int, completed: bool):
+        self.name = name
+        self.elapsed = elapsed
+        self.units = units
+        self.completed = completed
+
+
+class TurnScheduler:
+    """Runs the phases of a turn within a total time budget."""
+
+    def __init__(self, time_budget: float, clock=time.perf_counter):
+        self.time_budget = time_budget
+        self.clock = clock
+        self._phases = []
+
+    def add_phase(self, name: str, share: float, work):
+        """Adds a phase, after all the phases added so far.
+
+        `work` is called with the arguments given to `run` followed by the
+        `Budget` of the phase, and should return an iterator (usually it is a
+        generator function), which yields after each unit of work.
+        `share` is the relative part of the remaining time this phase gets.
+        """
+        self._phases.append((name, share, work))
+
+    def run(self, *args) -> list[PhaseReport]:
+        """Runs all the phases, and returns their reports in order.
+
+        An exception raised by a phase is re-raised, naming the phase.
+        """
+        turn_deadline = self.clock() + self.time_budget
+        shares_left = sum(share for _, share, _ in self._phases)
+        reports = []
+        for name, share, work in self._phases:
+            start = self.clock()
+            deadline = start + max(turn_deadline - start, 0.0) * share / shares_left if shares_left else start
+            shares_left -= share
+            budget = Budget(deadline, self.clock)
+            units = 0
+            completed = True
+            try:
+                with section(f'phase {name}'):
+                    steps = work(*args, budget)
+                    for _ in steps:
+                        units += 1
+                        if budget.expired():
+                            completed = False
+                            close = getattr(steps, 'close', None)
+                            if close is not None:
+                                close()
+                            break
+            except Exception as e:
+                raise Exception(f'{name} exception') from e
+            reports.append(PhaseReport(name, self.clock() - start, units, completed))
+        return reports
@@ -1,10 +1,15 @@
 import math
 import random
-import strategic_api as strat
 from strategic_api import StrategicApi, StrategicPiece
 
-from common_types import Coordinates, distance
-import common_types
+import assignment
+import logs
+import profiling
+from common_types import Coordinates
+from scheduler import Budget, TurnScheduler
+from spatial import PieceIndex
+
+log = logs.get_log("simple_strategic")
 
 piece_to_price = {"tank": 8, "builder": 20}
 
@@ -13,76 +18,43 @@ PIECES = ["tank", "builder"]
 PROBS = [70, 30]
 TO_BUILD = {}  # builder object is mapped to str
 DEF_RADIUS = 2
+TANKS_PER_TILE = 2
+ATTACK_DEPTH = 3  # Max distance of attacked tiles from our territory.
+ASSIGNMENT_TIME_BUDGET = 0.5  # Seconds.
+TURN_TIME_BUDGET = 1.0  # Seconds, for all the phases of do_turn.
+# Phases of a turn, in priority order, with their relative shares of the time.
+PHASE_SHARES = {"economy": 0.2, "attack": 0.6, "defense": 0.2}
 
 
+@profiling.profiled
 def get_sorted_tiles_for_attack(strategic):
-    unclaimed_tiles = []
-    enemy_tiles = []
-    for x in range(strategic.get_game_width()):
-        for y in range(strategic.get_game_height()):
-            coordinate = Coordinates(x, y)
-            danger = strategic.estimate_tile_danger(coordinate)
-            if danger == 1:
-                unclaimed_tiles.append(coordinate)
-            elif danger == 2:
-                enemy_tiles.append(coordinate)
-
-    random.shuffle(unclaimed_tiles)
-    random.shuffle(enemy_tiles)
-    return enemy_tiles + unclaimed_tiles
-
-
-def find_min_dist_to_pieces(
-    pieces: set[strat.StrategicPiece],
-    coord: Coordinates,
-    context: StrategicApi,
-):
-    min_dist = 10000
-    next_to_min = min_dist
-    con = context.context
-    for piece in pieces:
-        dis = distance(con.my_pieces[piece.id].tile.coordinates, coord)
-        if dis < min_dist:
-            next_to_min = min_dist
-            min_dist = dis
-    return (min_dist + next_to_min) / 2
-
-
-def sort_tiles(
-    attack_tiles: list[Coordinates],
-    pieces: set[StrategicPiece],
-    context: StrategicApi,
-):
-    attack_tiles.sort(key=lambda tile: find_min_dist_to_pieces(pieces, tile, context))
+    seed = random.getrandbits(32)
+    tiles = strategic.estimate_board_danger((1, 2), seed, ATTACK_DEPTH)
+    if not tiles[1] and not tiles[2]:
+        # We have no territory to expand from.
+        tiles = strategic.estimate_board_danger((1, 2), seed)
+    return tiles[2] + tiles[1]
 
 
-def assign_piece_to_close_tile(
-    tank: StrategicApi,
-):
-    pass
+def make_piece_index(strategic: StrategicApi, pieces: set[StrategicPiece]) -> PieceIndex:
+    my_pieces = strategic.context.my_pieces
+    return PieceIndex({piece: my_pieces[piece.id].tile.coordinates for piece in pieces})
 
 
-def choose_piece_for_tile(
-    pieces: set[StrategicPiece], coord: Coordinates, strategic: StrategicApi
-):
-    if len(pieces) == 0:
-        return []
-    con = strategic.context.my_pieces
-    min_dist = 10000
-    ret_pieces = []
-    for piece in pieces:
-        dist = distance(con[piece.id].tile.coordinates, coord)
-        if dist < min_dist:
-            min_dist = dist
-    for piece in pieces:
-        if distance(con[piece.id].tile.coordinates, coord) == min_dist:
-            ret_pieces.append(piece)
-            # strategic.context.log("added piece")
-            if len(ret_pieces) == 2:
-                break
-    for piece in ret_pieces:
-        pieces.remove(piece)
-    return ret_pieces
+@profiling.profiled
+def assign_tanks_to_tiles(
+    strategic: StrategicApi,
+    tanks: set[StrategicPiece],
+    tiles: list[Coordinates],
+    time_budget: float = ASSIGNMENT_TIME_BUDGET,
+) -> dict[StrategicPiece, Coordinates]:
+    my_pieces = strategic.context.my_pieces
+    return assignment.assign(
+        {tank: my_pieces[tank.id].tile.coordinates for tank in sorted(tanks)},
+        tiles,
+        quota=TANKS_PER_TILE,
+        time_budget=time_budget,
+    )
 
 
 def builder_decision(
@@ -94,10 +66,11 @@ def builder_decision(
     strategic.build_piece(builder, random.choices(PIECES, weights=PROBS, k=1)[0])
 
 
-def do_builder_stuff(strategic: StrategicApi):
+def do_builder_stuff(strategic: StrategicApi, budget: Budget):
     builders = strategic.report_builders()
     for builder, info in builders.items():
         builder_decision(strategic, builder, info[0], info[1])
+        yield
 
 
 def choose_random_dest(strategic: StrategicApi, tank: StrategicPiece):
@@ -119,24 +92,24 @@ def choose_random_dest(strategic: StrategicApi, tank: StrategicPiece):
     elif cos_t <= 0:
         thet = 3 * math.pi / 2 - thet
     theta += thet
-    strategic.context.log(f"theta={theta*180/math.pi} degree")
+    log.debug("theta=%s degree", theta * 180 / math.pi)
     if theta != math.pi / 2 and theta != 3 * math.pi / 2:
         if (
             tank_x - tank_y * math.tan(theta) >= 0
             and tank_x - tank_y * math.tan(theta) <= strategic.context.game_width
         ):
-            strategic.log("Theta is normal, x in bounds")
+            log.debug("Theta is normal, x in bounds")
             return (
                 int(tank_x - tank_y * math.tan(theta)),
                 0 if abs(theta) <= math.pi / 2 else strategic.context.game_height - 1,
             )
-        strategic.log("Theta is normal, y in bounds")
+        log.debug("Theta is normal, y in bounds")
         return (
             0 if theta <= math.pi else strategic.context.game_width - 1,
             int(tank_y - tank_x / math.tan(theta)),
         )
 
-    strategic.log("Theta not normal")
+    log.debug("Theta not normal")
     if theta == math.pi / 2:
         return (0, tank_y)
     return (strategic.context.game_width - 1, tank_y)
@@ -147,39 +120,26 @@ DEST_FOR_TANK: dict[str, Coordinates] = {}
 
 def find_near_tank(
     strategic: StrategicApi,
-    tank_set: set[StrategicPiece],
+    tank_index: PieceIndex,
     art: StrategicPiece,
     rad: int,
 ):
-    min_dist = 100000
-    close_tank = None
-    my_pcs = strategic.context.my_pieces
-    for tank in tank_set:
-        dis = distance(
-            my_pcs[tank.id].tile.coordinates, my_pcs[art.id].tile.coordinates
-        )
-        if dis < min_dist:
-            min_dist = dis
-            close_tank = tank
-    return close_tank
+    nearest = tank_index.nearest(strategic.context.my_pieces[art.id].tile.coordinates)
+    return nearest[0][1] if nearest else None
 
 
-def do_attack_stuff(strategic: StrategicApi):
+def do_attack_stuff(strategic: StrategicApi, budget: Budget):
     tiles_for_attack = get_sorted_tiles_for_attack(strategic)
     if len(tiles_for_attack) == 0:
         return
+    yield
     attacking_pieces = strategic.report_attacking_pieces()
-    available_pieces: set[StrategicPiece] = set()
+    stalled = strategic.report_stalled_commands()
     available_tanks: set[StrategicPiece] = set()
-    available_art: set[StrategicPiece] = set()
     for piece, command_id in attacking_pieces.items():
-        if command_id is None:
-            available_pieces.add(piece)
-            if piece.type == "tank":
-                available_tanks.add(piece)
-            elif piece.type == "artillery":
-                available_art.add(piece)
-    sort_tiles(tiles_for_attack, available_tanks, strategic)
+        # Pieces of stalled commands are given new targets.
+        if (command_id is None or command_id in stalled) and piece.type == "tank":
+            available_tanks.add(piece)
     """for tank in available_tanks:
         coords = choose_random_dest(strategic, tank)
         strategic.attack(
@@ -187,28 +147,15 @@ def do_attack_stuff(strategic: StrategicApi):
             Coordinates(coords[0], coords[1]),
             int(strategic.context.game_height / 3),
         )
-        strategic.context.log(f"(x,y)=({coords[0]},{coords[1]})")
+        strategic.log(f"(x,y)=({coords[0]},{coords[1]})")
         DEST_FOR_TANK[tank.id] = Coordinates(coords[0], coords[1])"""
-    for tile in tiles_for_attack:
-        pieces = choose_piece_for_tile(available_tanks, tile, strategic)
-        if pieces == []:
-            continue
-        if pieces is None:
-            strategic.context.log("IS NONE")
-            continue
-        for piece in pieces:
-            logger = strategic.attack(piece, tile, 0)
-            DEST_FOR_TANK[piece.id] = tile
-            strategic.log(f"Attack: {logger}")
-    for art in available_art:  # Not supposed to run 0 available_art is empty
-        tank = find_near_tank(strategic, available_tanks, art, DEF_RADIUS)
-        if tank.id in DEST_FOR_TANK:
-            logger = strategic.defend([art], DEST_FOR_TANK[tank.id], DEF_RADIUS)
-        else:
-            logger = strategic.defend(
-                [art], strategic.context.my_pieces[tank.id].tile.coordinates, DEF_RADIUS
-            )
-        strategic.log(f"Defend: {logger}")
+    time_budget = min(ASSIGNMENT_TIME_BUDGET, budget.remaining())
+    for piece, tile in assign_tanks_to_tiles(strategic, available_tanks, tiles_for_attack, time_budget).items():
+        logger = strategic.attack(piece, tile, 0)
+        DEST_FOR_TANK[piece.id] = tile
+        log.debug("Attack: %s", logger)
+        yield
+
     """tile_index = 0
     for piece, command_id in attacking_pieces.items():
         if command_id is not None:
@@ -219,14 +166,39 @@ def do_attack_stuff(strategic: StrategicApi):
             break"""
 
 
+def do_defense_stuff(strategic: StrategicApi, budget: Budget):
+    available_tanks: set[StrategicPiece] = set()
+    available_art: set[StrategicPiece] = set()
+    for piece, command_id in strategic.report_attacking_pieces().items():
+        if piece.type == "tank":
+            available_tanks.add(piece)
+        elif command_id is None and piece.type == "artillery":
+            available_art.add(piece)
+    if not available_art:  # Not supposed to run 0 available_art is empty
+        return
+    tank_index = make_piece_index(strategic, available_tanks)
+    for art in available_art:
+        tank = find_near_tank(strategic, tank_index, art, DEF_RADIUS)
+        if tank is None:
+            continue
+        if tank.id in DEST_FOR_TANK:
+            logger = strategic.defend([art], DEST_FOR_TANK[tank.id], DEF_RADIUS)
+        else:
+            logger = strategic.defend(
+                [art], strategic.context.my_pieces[tank.id].tile.coordinates, DEF_RADIUS
+            )
+        log.debug("Defend: %s", logger)
+        yield
+
+
 def do_turn(strategic: StrategicApi):
-    strategic.log("hello world")
-    try:
-        do_builder_stuff(strategic)
-    except Exception:
-        raise Exception("builder Exception")
-    try:
-        do_attack_stuff(strategic)
-        pass
-    except Exception:
-        raise Exception("attack exception")
+    log.debug("hello world")
+    scheduler = TurnScheduler(TURN_TIME_BUDGET)
+    scheduler.add_phase("economy", PHASE_SHARES["economy"], do_builder_stuff)
+    scheduler.add_phase("attack", PHASE_SHARES["attack"], do_attack_stuff)
+    scheduler.add_phase("defense", PHASE_SHARES["defense"], do_defense_stuff)
+    for report in scheduler.run(strategic):
+        if not report.completed:
+            log.warning("%s out of time after %s steps", report.name, report.units)
+    profiling.flush(strategic)
+    strategic.flush_log()
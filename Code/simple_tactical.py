@@ -1,8 +1,20 @@
+import board
 import common_types
-from strategic_api import CommandStatus, StrategicApi, StrategicPiece
+from board import NO_COUNTRY, get_board_grid, get_distance_map, get_ownership_index
+from commands import ATTACK, BUILD, Command, get_command_registry
+from economy import MAX_COLLECT, get_money_router
+from estimates import build_key, collect_key, get_turn_estimator, movement_key
+from log_buffer import get_turn_log
+import logs
+from pathing import get_path_finder
+from profiling import profiled, section
+from strategic_api import StrategicApi, StrategicPiece
 from tactical_api import TurnContext, Builder, BasePiece, distance, Tile
+from turn_state import track_turn
 
-from random import randint, choices
+from random import Random, shuffle
+
+log = logs.get_log('simple_tactical')
 
 PRICES = {
     'builder': 20,
@@ -31,107 +43,130 @@ BUILD_FUNCTIONS = {
     'satellite': Builder.build_satellite,
 }
 
-tank_to_coordinate_to_attack = {}
-tank_to_attacking_command = {}
-commands = []
-
-builder_to_amount: dict[str, int] = {}
-builder_to_piece: dict[str, str] = {}
-builder_to_command: dict[str, str] = {}
 
 
-def move_tank_to_destination(context, tank, dest: common_types.Coordinates, radius):
+@profiled
+def move_tank_to_destination(context, tank, command: Command):
     """Returns True if the tank's mission is complete."""
     try:
+        dest = command.data['destination']
+        radius = command.data['radius']
         #context.log(f'tank location: ({tank.tile.coordinates.x}, {tank.tile.coordinates.y})\ttank destination: ({dest.x}, {dest.y})\tradius: {radius}')
-        command_id = tank_to_attacking_command[tank.id]
         if dest is None:
-            commands[int(command_id)] = CommandStatus.failed(command_id)
+            get_command_registry().fail(command)
             return
+        dest = get_path_finder(context).clamp(dest)
         if distance(dest, tank.tile.coordinates) <= radius:
             tank.attack()
-            commands[int(command_id)] = CommandStatus.success(command_id)
-            del tank_to_attacking_command[tank.id]
+            get_command_registry().succeed(command)
             return True
         tank_coordinate = tank.tile.coordinates
-        if tank.tile.country != context.my_country:
+        if not get_ownership_index(context).is_mine(tank_coordinate):
             tank.attack()
             return False
-        dest.x = max(dest.x, 0)
-        dest.x = min(dest.x, context.game_width - 1)
-        dest.y = max(dest.y, 0)
-        dest.y = min(dest.y, context.game_height)
-        x_dist = abs(dest.x - tank.tile.coordinates.x)
-        y_dist = abs(dest.y - tank.tile.coordinates.y)
-        randomized = choices([0, 1], weights=[x_dist, y_dist])
-        if randomized == 0:
-            if dest.x < tank_coordinate.x:
-                new_coordinate = common_types.Coordinates(tank_coordinate.x - 1, tank_coordinate.y)
-            else:
-                new_coordinate = common_types.Coordinates(tank_coordinate.x + 1, tank_coordinate.y)
-        else:
-            if dest.y < tank_coordinate.y:
-                new_coordinate = common_types.Coordinates(tank_coordinate.x, tank_coordinate.y - 1)
-            else:
-                new_coordinate = common_types.Coordinates(tank_coordinate.x, tank_coordinate.y + 1)
+        new_coordinate = get_path_finder(context).next_step(tank_coordinate, dest)
         tank.move(new_coordinate)
-        #context.log(f'randomized: {randomized}\tnew coordinates: {new_coordinate}')
+        #context.log(f'new coordinates: {new_coordinate}')
         return False
     except Exception:
-        context.log("move_tank_to_destination log")
+        log.warning("move_tank_to_destination log")
+
+
+@profiled
+def estimate_remaining_turns(context: TurnContext, command: Command):
+    """Estimates the amount of turns left until the command is complete.
+
+    Returns None if the piece of the command is gone.
+    """
+    piece = context.my_pieces.get(command.piece_id)
+    if piece is None:
+        return None
+    coordinates = piece.tile.coordinates
+    if command.type == ATTACK:
+        destination = command.data['destination']
+        if destination is None:
+            return None
+        path_finder = get_path_finder(context)
+        destination = path_finder.clamp(destination)
+        if distance(destination, coordinates) <= command.data['radius']:
+            return 0
+        cost = path_finder.field(destination, coordinates).distance(coordinates)
+        return max(cost - command.data['radius'], 1)
+    if command.type == BUILD:
+        return estimate_build_turns(piece, command.data['piece_type'])
+    return None
+
+
+def estimate_build_turns(builder: Builder, piece_type: str) -> int:
+    """Estimates the turns left for collecting the price of the piece and building it."""
+    missing = PRICES[piece_type] - builder.money
+    return 1 + max(0, -(-missing // MAX_COLLECT))
+
+
+def record_command_duration(command: Command):
+    """Records the duration of a successful command, for future estimates."""
+    key = command.data.get('estimate_key')
+    if key is not None:
+        get_turn_estimator().record(key, get_command_registry().turn - command.issued_turn)
 
 
 def is_our_land(context: TurnContext, coordinates: common_types.Coordinates):
-    for tile in context.get_tiles_of_country(context.my_country):
-        if tile.x == coordinates.x and tile.y == coordinates.y:
+    return get_ownership_index(context).is_mine(coordinates)
+
+def move_in_random_direction(piece: BasePiece, context) -> bool:
+    """Moves the piece to a random adjacent tile of my country.
+
+    Returns False (and does not move the piece) if there is no such tile.
+    """
+    x, y = piece.tile.coordinates
+    destinations = [
+        common_types.Coordinates(x + 1, y),
+        common_types.Coordinates(x - 1, y),
+        common_types.Coordinates(x, y + 1),
+        common_types.Coordinates(x, y - 1),
+    ]
+    shuffle(destinations)
+    for destination in destinations:
+        if (0 <= destination.x < context.game_width and 0 <= destination.y < context.game_height and
+                is_our_land(context, destination)):
+            piece.move(destination)
             return True
-        
     return False
 
-def move_in_random_direction(piece: BasePiece, context) -> None:
-	coords = piece.tile.coordinates
 
-	dest = {
-		0: common_types.Coordinates(coords.x + 1, coords.y),
-		1: common_types.Coordinates(coords.x - 1, coords.y),
-		2: common_types.Coordinates(coords.x, coords.y + 1),
-		3: common_types.Coordinates(coords.x, coords.y - 1),
-	}
-	direction = randint(0, 3)
-	while dest[direction][0] < 0 or dest[direction][0] > context.game_width or dest[direction][1] < 0 or \
-			dest[direction][1] > context.game_width or not is_our_land(context, dest[direction]):
-		direction = randint(0, 3)
-	piece.move(dest[direction])
+def collect_money_advance(builder: Builder, amount: int, context: TurnContext) -> bool:
+    registry = get_command_registry()
+    command = registry.of_piece(builder.id)
 
+    coordinates = builder.tile.coordinates
+    step = get_money_router(context).route(coordinates, amount)
+    if step == coordinates:
+        collected = min(MAX_COLLECT, builder.tile.money or 0)
+        amount -= collected
 
-def collect_money_advance(builder: Builder, amount: int, context: TurnContext) -> bool:
-    command_id = builder_to_command[builder.id]
+        builder.collect_money(collected)
 
-    if builder.tile.money > 0 and builder.tile.country == context.my_country:
-        amount -= min(5,builder.tile.money)
-        
-        builder.collect_money(min(5,builder.tile.money))
-            
         if amount <= 0:
-            commands[int(command_id)] = CommandStatus.success(command_id)
-            #del builder_to_command[builder.id]
+            registry.succeed(command)
             return True
     else:
-        move_in_random_direction(builder, context)
-        commands[int(command_id)] = CommandStatus.in_progress(command_id, 0, 999999999)
+        if step is not None:
+            builder.move(step)
+        else:
+            move_in_random_direction(builder, context)
+        registry.progress(command, command.remaining_turns)
 
     return False
 
 
 def build_piece_advance(builder: Builder, piece: str, context: TurnContext) -> bool:
-    command_id = builder_to_command[builder.id]
+    command = get_command_registry().of_piece(builder.id)
 
     cost = PRICES[piece]
 
     if builder.money >= cost:
         BUILD_FUNCTIONS[piece](builder)
-        commands[int(command_id)] = CommandStatus.success(command_id)
-        del builder_to_command[builder.id]
+        get_command_registry().succeed(command)
         return True
     else:
         collect_money_advance(builder, 1000, context)
@@ -142,58 +177,42 @@ def build_piece_advance(builder: Builder, piece: str, context: TurnContext) -> b
 class MyStrategicApi(StrategicApi):
     def __init__(self, context):
         self.context = context
-        to_remove = set()
-        for tank_id, (destination, radius) in tank_to_coordinate_to_attack.items():
-            tank = self.context.my_pieces.get(tank_id)
-            if tank is None:
-                to_remove.add(tank_id)
-                continue
-            try:
-                success = move_tank_to_destination(self.context, tank, destination, radius)
-            except Exception:
-                raise Exception("attack exception")
-            if success:
-                to_remove.add(tank_id)
-        for tank_id in to_remove:
-            del tank_to_coordinate_to_attack[tank_id]
-        to_remove.clear()
+        get_turn_log(context)
+        self.turn_diff = track_turn(context)
+        self.commands = get_command_registry()
+        self.commands.on_success = record_command_duration
+        self.commands.tick(self.turn_diff.turn, lambda command: estimate_remaining_turns(context, command))
+        self.estimator = get_turn_estimator()
+        self.estimator.save_if_needed(self.turn_diff.turn)
+        with section('advance attacks'):
+            for command in self.commands.of_type(ATTACK):
+                tank = self.context.my_pieces.get(command.piece_id)
+                if tank is None:
+                    self.commands.fail(command)
+                    continue
+                try:
+                    move_tank_to_destination(self.context, tank, command)
+                except Exception:
+                    raise Exception("attack exception")
         self.loop_builders()
 
+    @profiled
     def loop_builders(self):
-        def remove(b_id):
-            if b_id in builder_to_piece:
-                del builder_to_piece[b_id]
-            if b_id in builder_to_amount:
-                del builder_to_amount[b_id]
-        
-        remove_set = []
-        for builder_id, piece in builder_to_piece.items():
-            builder_piece = self.context.my_pieces.get(builder_id)
-            
+        for command in self.commands.of_type(BUILD):
+            builder_piece = self.context.my_pieces.get(command.piece_id)
+
             if builder_piece is None:
-                remove_set.append(builder_id)
+                self.commands.fail(command)
                 continue
-        
-            if build_piece_advance(builder_piece, piece, self.context):
-                remove_set.append(builder_id)
-                
-        for item in remove_set:
-            remove(item)
-        remove_set = []
-        
-        #for builder_id, piece in builder_to_amount.items():
-        #    builder = self.context.my_pieces.get(builder_id)
+
+            build_piece_advance(builder_piece, command.data['piece_type'], self.context)
+
+        #for command in self.commands.of_type(COLLECT):
+        #    builder = self.context.my_pieces.get(command.piece_id)
         #    if builder is None or not isinstance(builder, Builder):
-        #        if builder_id in builder_to_command[builder_id]:
-        #            c_id = builder_to_command[builder_id]
-        #            commands[int(c_id)] = CommandStatus.failed(c_id)
-        #            del builder_to_command[builder_id]
-        #        remove_set.append(builder_id)
+        #        self.commands.fail(command)
         #        continue
-        #    if collect_money_advance(builder, piece):
-        #        remove_set.append(builder_id)
-        for item in remove_set:
-            remove(item)
+        #    collect_money_advance(builder, command.data['amount'], self.context)
 
     def attack(self, piece, destination, radius):
         try:
@@ -201,45 +220,128 @@ class MyStrategicApi(StrategicApi):
             if not tank or tank.type != 'tank':
                 return None
 
-            if piece.id in tank_to_attacking_command:
-                old_command_id = int(tank_to_attacking_command[piece.id])
-                commands[old_command_id] = CommandStatus.failed(old_command_id)
+            key, estimate = self._movement_estimate(ATTACK, tank, destination, radius)
+            command = self.commands.issue(ATTACK, piece.id, estimate,
+                                          destination=destination, radius=radius, estimate_key=key)
+            return command.id
+        except Exception:
+            log.warning("inner attack log")
 
-            command_id = str(len(commands))
-            attacking_command = CommandStatus.in_progress(command_id, 0,
-                                                        common_types.distance(tank.tile.coordinates, destination))
-            tank_to_coordinate_to_attack[piece.id] = destination, radius
-            tank_to_attacking_command[piece.id] = command_id
-            commands.append(attacking_command)
+    def _movement_estimate(self, command_type, piece, destination, radius):
+        """Returns the estimate key and the estimated turns for moving the piece."""
+        d = common_types.distance(piece.tile.coordinates, destination)
+        key = movement_key(command_type, piece.type, d, radius)
+        return key, self.estimator.estimate(key, max(d - radius, 0))
 
-            return command_id
-        except Exception:
-            self.context.log("inner attack log")
+    def _estimate_movement_time(self, command_type, pieces, destination, radius):
+        estimates = [self._movement_estimate(command_type, self.context.my_pieces[piece.id], destination, radius)[1]
+                     for piece in pieces if piece.id in self.context.my_pieces]
+        return max(estimates, default=0)
+
+    def estimate_attack_time(self, pieces, destination, radius):
+        return self._estimate_movement_time(ATTACK, pieces, destination, radius)
+
+    def estimate_defend_time(self, pieces, destination, radius):
+        return self._estimate_movement_time('defend', pieces, destination, radius)
+
+    def estimate_gathering_time(self, pieces, destination, radius):
+        return self._estimate_movement_time('gather', pieces, destination, radius)
+
+    def report_attack_command_status(self, command_id):
+        return self.commands.status(command_id)
+
+    def report_stalled_commands(self):
+        """Returns the IDs of the in-flight commands that have stopped progressing."""
+        return {command.id for command in self.commands.stalled()}
 
     def estimate_tile_danger(self, destination):
-        tile = self.context.tiles[(destination.x, destination.y)]
-        if tile.country == self.context.my_country:
+        country = get_ownership_index(self.context).owner(destination)
+        if country == self.context.my_country:
             return 0
-        elif tile.country is None:
+        elif country is None:
             return 1
         else:  # Enemy country
             return 2
 
+    @profiled
+    def estimate_board_danger(self, levels=(1, 2), shuffle_seed=None, max_distance=None):
+        """Estimate the danger level of all the board tiles at once.
+
+        Returns a dict, mapping each of the given danger levels (as returned by
+        `estimate_tile_danger`) to the list of coordinates of that level. The
+        lists are sorted by x and then by y, unless `shuffle_seed` is given, in
+        which case each list is shuffled deterministically by that seed.
+        If `max_distance` is given, only tiles whose distance from my territory
+        is at most `max_distance` are returned.
+        """
+        my_country = self.context.my_country
+        grid = get_board_grid(self.context)
+        if grid is not None:
+            owners = grid.owners
+            masks = {
+                0: owners == grid.my_country_id,
+                1: owners == NO_COUNTRY,
+                2: (owners != grid.my_country_id) & (owners != NO_COUNTRY),
+            }
+            if max_distance is not None:
+                near = get_distance_map(self.context, my_country).array <= max_distance
+                masks = {level: mask & near for level, mask in masks.items()}
+            rng = None if shuffle_seed is None else board.np.random.default_rng(shuffle_seed)
+            return {level: grid.coordinates(masks[level], rng) for level in levels}
+
+        index = get_ownership_index(self.context)
+        tiles = {0: set(), 1: set(), 2: set()}
+        for country in self.context.all_countries:
+            if country == my_country:
+                tiles[0] = index.tiles_of(country)
+            else:
+                tiles[2] |= index.tiles_of(country)
+        tiles[1] = index.tiles_of(None)
+        distance_map = None if max_distance is None else get_distance_map(self.context, my_country)
+        rng = Random(shuffle_seed)
+        result = {}
+        for level in levels:
+            result[level] = sorted(common_types.Coordinates(x, y) for x, y in tiles[level]
+                                   if distance_map is None or distance_map.distance((x, y)) <= max_distance)
+            if shuffle_seed is not None:
+                rng.shuffle(result[level])
+        return result
+
+    def log(self, log_entry):
+        get_turn_log(self.context).log(log_entry)
+
+    def flush_log(self):
+        """Writes the log entries buffered in this turn."""
+        get_turn_log(self.context).flush()
+
     def get_game_height(self):
         return self.context.game_height
 
     def get_game_width(self):
         return self.context.game_width
 
+    def _command_id_of(self, piece_id, command_type):
+        command = self.commands.of_piece(piece_id)
+        if command is None or command.type != command_type:
+            return None
+        return command.id
+
     def report_attacking_pieces(self):
-        return {StrategicPiece(piece_id, piece.type): tank_to_attacking_command.get(piece_id)
+        return {StrategicPiece(piece_id, piece.type): self._command_id_of(piece_id, ATTACK)
                 for piece_id, piece in self.context.my_pieces.items()
                 if piece.type == 'tank'}
 
     def report_builders(self):
-        return {StrategicPiece(piece.id, piece.type) : (builder_to_command.get(piece.id), builder_to_amount.get(piece.id, 0))
-                for piece_id, piece in self.context.my_pieces.items()
-                if piece.type == 'builder'}
+        result = {}
+        for piece_id, piece in self.context.my_pieces.items():
+            if piece.type != 'builder':
+                continue
+            command = self.commands.of_piece(piece_id)
+            if command is None:
+                result[StrategicPiece(piece_id, piece.type)] = (None, 0)
+            else:
+                result[StrategicPiece(piece_id, piece.type)] = (command.id, command.data.get('amount', 0))
+        return result
 
     def collect_money_stupid(self, builder: StrategicPiece, amount: int) -> str:
         builder1 = self.context.my_pieces[builder.id]
@@ -267,19 +369,7 @@ class MyStrategicApi(StrategicApi):
         #if not builder1 or not isinstance(builder1, Builder):
         #    return ""
 
-        #if builder.id in builder_to_command:
-        #    if builder.id in builder_to_piece:
-        #        del builder_to_piece[builder.id]
-        #    command_id = builder_to_command[builder.id]
-        #    commands[int(command_id)] = CommandStatus.failed(command_id)
-
-        #command_id = str(len(commands))
-        #command = CommandStatus.in_progress(command_id, 0, 999999)
-        #builder_to_amount[builder.id] = amount
-        #builder_to_command[builder.id] = command_id
-        #commands.append(command)
-
-        #return command_id
+        #return self.commands.issue(COLLECT, builder.id, 999999, amount=amount).id
 
     def build_piece(self, builder: StrategicPiece, piece_type: str) -> str:
         builder_piece = self.context.my_pieces[builder.id]
@@ -290,25 +380,25 @@ class MyStrategicApi(StrategicApi):
         if not piece_type in PRICES:
             return None
 
-        if builder.id in builder_to_command:
-            if builder.id in builder_to_amount:
-                del builder_to_amount[builder.id]
-            command_id = builder_to_command[builder.id]
-            commands[int(command_id)] = CommandStatus.failed(command_id)
+        key = build_key(piece_type, PRICES[piece_type] - builder_piece.money)
+        command = self.commands.issue(BUILD, builder.id,
+                                      self.estimator.estimate(key, estimate_build_turns(builder_piece, piece_type)),
+                                      piece_type=piece_type, estimate_key=key)
 
-        command_id = str(len(commands))
-        command = CommandStatus.in_progress(command_id, 0, 999999)
-        
-        
-        
-        builder_to_piece[builder.id] = piece_type
-        
-        
-        
-        builder_to_command[builder.id] = command_id
-        commands.append(command)
+        return command.id
+
+    def estimate_building_time(self, builder: StrategicPiece, piece_type: str) -> int:
+        builder_piece = self.context.my_pieces[builder.id]
+        key = build_key(piece_type, PRICES[piece_type] - builder_piece.money)
+        return self.estimator.estimate(key, estimate_build_turns(builder_piece, piece_type))
+
+    def estimate_collection_time(self, builder: StrategicPiece, amount: int) -> int:
+        builder_piece = self.context.my_pieces[builder.id]
+        key = collect_key(amount, builder_piece.tile.money or 0)
+        return self.estimator.estimate(key, -(-amount // MAX_COLLECT))
 
-        return command_id
+    def report_build_command_status(self, command_id):
+        return self.commands.status(command_id)
 
 
 def get_strategic_implementation(context):
@@ -0,0 +1,134 @@
+"""Spatial index of pieces, for nearest-piece queries by L1 distance."""
+from __future__ import annotations
+import collections
+import math
+
+from common_types import Coordinates
+
+
+class PieceIndex:
+    """A bucket grid of pieces, keyed by their coordinates.
+
+    The area of the pieces is split into square cells, so that each cell holds
+    about one piece on average. Queries scan only the cells around the queried
+    tile, and never scan cells out of the bounding box of the pieces.
+    Pieces may be any hashable objects (usually `StrategicPiece`s).
+    """
+
+    def __init__(self, pieces: dict[object, Coordinates]):
+        self.cell_size = _cell_size(pieces.values())
+        self._cells: dict[tuple[int, int], dict[object, Coordinates]] = collections.defaultdict(dict)
+        self._bounds = None
+        self._locations: dict[object, Coordinates] = {}
+        self._order: dict[object, int] = {}
+        for piece, coordinates in pieces.items():
+            self.add(piece, coordinates)
+
+    def __len__(self):
+        return len(self._locations)
+
+    def __contains__(self, piece):
+        return piece in self._locations
+
+    def __iter__(self):
+        return iter(self._locations)
+
+    def _cell_of(self, coordinates: Coordinates) -> tuple[int, int]:
+        return coordinates[0] // self.cell_size, coordinates[1] // self.cell_size
+
+    def add(self, piece, coordinates: Coordinates):
+        """Adds a piece to the index, or moves it if it is already there."""
+        if piece in self._locations:
+            self.remove(piece)
+        self._locations[piece] = coordinates
+        self._order.setdefault(piece, len(self._order))
+        cx, cy = cell = self._cell_of(coordinates)
+        self._cells[cell][piece] = coordinates
+        if self._bounds is None:
+            self._bounds = (cx, cy, cx, cy)
+        else:
+            x0, y0, x1, y1 = self._bounds
+            self._bounds = (min(x0, cx), min(y0, cy), max(x1, cx), max(y1, cy))
+
+    def remove(self, piece):
+        """Removes a piece from the index. Missing pieces are ignored."""
+        coordinates = self._locations.pop(piece, None)
+        if coordinates is None:
+            return
+        cell = self._cell_of(coordinates)
+        del self._cells[cell][piece]
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def location(self, piece) -> Coordinates:
+        return self._locations[piece]
+
+    def _ring(self, cx: int, cy: int, r: int):
+        """Yields the non-empty cells whose L1 distance from (cx, cy) is r, in cells."""
+        cells = self._cells
+        x0, y0, x1, y1 = self._bounds
+        for x in range(max(cx - r, x0), min(cx + r, x1) + 1):
+            dy = r - abs(x - cx)
+            if y0 <= cy - dy <= y1 and (x, cy - dy) in cells:
+                yield cells[x, cy - dy]
+            if dy and y0 <= cy + dy <= y1 and (x, cy + dy) in cells:
+                yield cells[x, cy + dy]
+
+    def nearest(self, coordinates: Coordinates, k: int = 1) -> list[tuple[int, object]]:
+        """Returns the k pieces nearest to the given coordinates.
+
+        The returned value is a list of (distance, piece) tuples, sorted by
+        distance. Pieces of the same distance are ordered by the order in which
+        they were added to the index.
+        """
+        if k <= 0 or not self._locations:
+            return []
+        x, y = coordinates[0], coordinates[1]
+        cx, cy = self._cell_of(coordinates)
+        x0, y0, x1, y1 = self._bounds
+        min_ring = max(x0 - cx, cx - x1, 0) + max(y0 - cy, cy - y1, 0)
+        max_ring = max(cx - x0, x1 - cx) + max(cy - y0, y1 - cy)
+        order = self._order
+        found = []
+        for r in range(min_ring, max_ring + 1):
+            for pieces in self._ring(cx, cy, r):
+                for piece, (px, py) in pieces.items():
+                    found.append((abs(px - x) + abs(py - y), order[piece], piece))
+            # Pieces in cells out of ring r are more than (r - 1) * cell_size away.
+            if len(found) >= k:
+                found.sort()
+                if found[k - 1][0] <= (r - 1) * self.cell_size:
+                    break
+        found.sort()
+        return [(dist, piece) for dist, _, piece in found[:k]]
+
+    def within(self, coordinates: Coordinates, radius: int) -> list[tuple[int, object]]:
+        """Returns all the pieces whose distance from the coordinates is at most radius.
+
+        The returned value is a list of (distance, piece) tuples, sorted by
+        distance.
+        """
+        if not self._locations:
+            return []
+        x, y = coordinates[0], coordinates[1]
+        x0, y0, x1, y1 = self._bounds
+        found = []
+        for cx in range(max(x0, (x - radius) // self.cell_size), min(x1, (x + radius) // self.cell_size) + 1):
+            for cy in range(max(y0, (y - radius) // self.cell_size), min(y1, (y + radius) // self.cell_size) + 1):
+                for piece, (px, py) in self._cells.get((cx, cy), {}).items():
+                    dist = abs(px - x) + abs(py - y)
+                    if dist <= radius:
+                        found.append((dist, self._order[piece], piece))
+        found.sort()
+        return [(dist, piece) for dist, _, piece in found]
+
+
+def _cell_size(locations) -> int:
+    """Returns a cell size, for which each cell holds about one piece."""
+    locations = list(locations)
+    if not locations:
+        return 1
+    xs = [coordinates[0] for coordinates in locations]
+    ys = [coordinates[1] for coordinates in locations]
+    area = (max(xs) - min(xs) + 1) * (max(ys) - min(ys) + 1)
+    return max(1, int(math.sqrt(area / len(locations))))
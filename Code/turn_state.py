@@ -0,0 +1,147 @@
+"""Tracking of the game state between turns.
+
+`track_turn` is expected to be called once at the beginning of every turn. It
+keeps a snapshot of the previous turn and returns a `TurnDiff` describing what
+has changed since then. Derived indexes (see `board`) use the diff in order to
+update their previous-turn state instead of rebuilding it from scratch.
+
+The snapshot covers the territories of all the countries, the locations of all
+the known pieces and the money on the tiles of my country. Building it costs
+O(pieces + my territory) Python operations, and set operations over the
+territories of the countries.
+"""
+from __future__ import annotations
+
+from common_types import Coordinates
+
+from profiling import profiled
+from tactical_api import TurnContext
+
+_tracker = None
+
+
+class TurnSnapshot:
+    """The parts of a `TurnContext` that are compared between turns."""
+
+    def __init__(self, context: TurnContext):
+        self.my_country = context.my_country
+        self.countries = [country for country in context.all_countries if country is not None]
+        self.territories: dict[str, set[Coordinates]] = {
+            country: set(context.get_tiles_of_country(country)) for country in self.countries
+        }
+        self.pieces: dict[str, tuple[str, str, Coordinates]] = {
+            piece_id: (piece.type, piece.country, piece.tile.coordinates)
+            for piece_id, piece in context.all_pieces.items()
+        }
+        self.money: dict[Coordinates, int] = {}
+        tiles = context.tiles
+        for coordinates in self.territories.get(self.my_country, ()):
+            money = tiles[coordinates].money
+            if money is not None:
+                self.money[coordinates] = money
+
+
+class TurnDiff:
+    """The changes between two consecutive turns.
+
+    This class exports the following fields:
+    * turn: The number of this turn, counted from the first tracked turn.
+    * full: True iff there is no previous turn to compare with. In that case all
+            the other fields are empty, and everything should be rebuilt.
+    * owners: Maps the coordinates of each tile whose owner has changed to a
+              tuple of (old owner, new owner). Owners are country names, or None.
+    * new_pieces: The set of IDs of pieces that were not known before.
+    * dead_pieces: The set of IDs of pieces that are no longer known.
+    * moved_pieces: Maps the ID of each piece that has moved to a tuple of (old
+                    coordinates, new coordinates).
+    * money: Maps the coordinates of each tile of my country whose money has
+             changed to the change in its money.
+    """
+
+    def __init__(self, turn: int, previous: None | TurnSnapshot, current: TurnSnapshot):
+        self.turn = turn
+        self.full = previous is None
+        self.owners: dict[Coordinates, tuple[None | str, None | str]] = {}
+        self.new_pieces: set[str] = set()
+        self.dead_pieces: set[str] = set()
+        self.moved_pieces: dict[str, tuple[Coordinates, Coordinates]] = {}
+        self.money: dict[Coordinates, int] = {}
+        if previous is not None:
+            self._compare(previous, current)
+
+    def _compare(self, previous: TurnSnapshot, current: TurnSnapshot):
+        for country in set(previous.countries) | set(current.countries):
+            old = previous.territories.get(country, set())
+            new = current.territories.get(country, set())
+            for coordinates in old - new:
+                self.owners[coordinates] = (country, self.owners.get(coordinates, (None, None))[1])
+            for coordinates in new - old:
+                self.owners[coordinates] = (self.owners.get(coordinates, (None, None))[0], country)
+
+        old_pieces = previous.pieces
+        new_pieces = current.pieces
+        self.new_pieces = new_pieces.keys() - old_pieces.keys()
+        self.dead_pieces = old_pieces.keys() - new_pieces.keys()
+        for piece_id, (_, _, coordinates) in new_pieces.items():
+            old_piece = old_pieces.get(piece_id)
+            if old_piece is not None and old_piece[2] != coordinates:
+                self.moved_pieces[piece_id] = (old_piece[2], coordinates)
+
+        for coordinates, money in current.money.items():
+            old_money = previous.money.get(coordinates)
+            if old_money is not None and old_money != money:
+                self.money[coordinates] = money - old_money
+
+    def __len__(self):
+        """Returns the amount of changes in this diff."""
+        return (len(self.owners) + len(self.new_pieces) + len(self.dead_pieces) +
+                len(self.moved_pieces) + len(self.money))
+
+
+class StateTracker:
+    """Keeps the snapshot of the previous turn, and diffs it with the current one."""
+
+    def __init__(self):
+        self.turn = -1
+        self.context = None
+        self.snapshot = None
+        self.diff = None
+
+    def update(self, context: TurnContext) -> TurnDiff:
+        if context is self.context:
+            return self.diff
+        snapshot = TurnSnapshot(context)
+        previous = self.snapshot
+        if previous is not None and previous.my_country != snapshot.my_country:
+            previous = None
+        self.turn += 1
+        self.diff = TurnDiff(self.turn, previous, snapshot)
+        self.context = context
+        self.snapshot = snapshot
+        return self.diff
+
+
+@profiled
+def track_turn(context: TurnContext) -> TurnDiff:
+    """Updates the tracked state with the given turn, and returns its diff.
+
+    Calling this function again with the same context returns the same diff.
+    """
+    global _tracker
+    if _tracker is None:
+        _tracker = StateTracker()
+    return _tracker.update(context)
+
+
+def get_turn_diff(context: TurnContext) -> None | TurnDiff:
+    """Returns the diff of the given turn, or None if it has not been tracked."""
+    if _tracker is None or _tracker.context is not context:
+        return None
+    return _tracker.diff
+
+
+def get_turn_snapshot(context: TurnContext) -> None | TurnSnapshot:
+    """Returns the snapshot of the given turn, or None if it has not been tracked."""
+    if _tracker is None or _tracker.context is not context:
+        return None
+    return _tracker.snapshot
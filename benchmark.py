@@ -0,0 +1,210 @@
+"""Turn-latency benchmark of the strategy code.
+
+Every scenario generates a simulated game (see `simulator.py`) of a certain
+size, lets the code play a few turns of its first country and measures each
+phase of its turns:
+* tactical: `get_strategic_implementation(context)` of the tactical module.
+* strategic: `do_turn(strategic)` of the strategic module.
+* total: both phases together.
+
+For each phase the p50/p99 turn time and the peak memory allocated during the
+phase are reported. Results can be saved as a JSON baseline, and later runs can
+be compared against it in order to flag regressions.
+"""
+import argparse
+import collections
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from simulator import CODE_DIRECTORY, Bot, Game
+
+PHASES = ['tactical', 'strategic', 'total']
+# Scenario name -> (width, height, countries, pieces of the benchmarked country,
+# territory radius).
+SCENARIOS = collections.OrderedDict([
+    ('20x20', (20, 20, 2, 10, 2)),
+    ('50x50', (50, 50, 4, 50, 4)),
+    ('100x100', (100, 100, 4, 200, 8)),
+    ('200x200', (200, 200, 8, 1000, 15)),
+    ('500x500', (500, 500, 16, 5000, 30)),
+])
+ENEMY_PIECES = 10
+DEFAULT_THRESHOLD = 0.2
+
+
+class TimedBot(Bot):
+    """A bot that measures the phases of its turns."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.durations = collections.defaultdict(list)
+        self.peaks = collections.defaultdict(int)
+        self.trace_memory = False
+
+    def _start_phase(self):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            return tracemalloc.get_traced_memory()[0]
+        return 0
+
+    def _end_phase(self, phase, start_memory):
+        if self.trace_memory:
+            peak = tracemalloc.get_traced_memory()[1] - start_memory
+            self.peaks[phase] = max(self.peaks[phase], peak)
+
+    def play(self, context):
+        start_memory = self._start_phase()
+        start = time.perf_counter()
+        strategic = self.tactical.get_strategic_implementation(context)
+        end = time.perf_counter()
+        self._end_phase('tactical', start_memory)
+        tactical_duration = end - start
+
+        start_memory = self._start_phase()
+        start = time.perf_counter()
+        self.strategic.do_turn(strategic)
+        end = time.perf_counter()
+        self._end_phase('strategic', start_memory)
+        strategic_duration = end - start
+
+        if not self.trace_memory:
+            self.durations['tactical'].append(tactical_duration)
+            self.durations['strategic'].append(strategic_duration)
+            self.durations['total'].append(tactical_duration + strategic_duration)
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of the given values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def make_game(width, height, countries, pieces, territory_radius, seed):
+    game = Game(width, height, countries, ENEMY_PIECES, seed, territory_radius)
+    country = game.countries[0]
+    territory = sorted(game.territories[country])
+    for _ in range(pieces - ENEMY_PIECES):
+        game.add_piece('tank', country, game.random.choice(territory))
+    return game
+
+
+def run_scenario(args, name):
+    width, height, countries, pieces, territory_radius = SCENARIOS[name]
+    random.seed(args.seed)
+    game = make_game(width, height, countries, pieces, territory_radius, args.seed)
+    bot = TimedBot(args.directory, args.tactical_module, args.strategic_module, name)
+    game.set_bot(game.countries[0], bot)
+
+    for _ in range(args.turns):
+        game.play_turn()
+
+    bot.trace_memory = True
+    tracemalloc.start()
+    try:
+        for _ in range(args.memory_turns):
+            game.play_turn()
+    finally:
+        tracemalloc.stop()
+    bot.peaks['total'] = max(bot.peaks['tactical'], bot.peaks['strategic'])
+
+    return {
+        'width': width,
+        'height': height,
+        'countries': countries,
+        'pieces': pieces,
+        'turns': len(bot.durations['total']),
+        'phases': {
+            phase: {
+                'p50_ms': 1000 * percentile(bot.durations[phase], 50),
+                'p99_ms': 1000 * percentile(bot.durations[phase], 99),
+                'peak_kb': bot.peaks[phase] / 1024,
+            }
+            for phase in PHASES
+        },
+    }
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of descriptions of regressions relative to the baseline."""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        old_result = baseline['scenarios'].get(name)
+        if old_result is None:
+            continue
+        for phase, stats in result['phases'].items():
+            old_stats = old_result['phases'].get(phase, {})
+            for key, value in stats.items():
+                old_value = old_stats.get(key)
+                if old_value and value > old_value * (1 + threshold):
+                    regressions.append(f'{name} {phase} {key}: {old_value:.2f} -> {value:.2f}')
+    return regressions
+
+
+def print_results(results):
+    print('{:<10} {:<10} {:>12} {:>12} {:>12}'.format('scenario', 'phase', 'p50 (ms)', 'p99 (ms)', 'peak (KB)'))
+    for name, result in results['scenarios'].items():
+        for phase, stats in result['phases'].items():
+            print('{:<10} {:<10} {:>12.2f} {:>12.2f} {:>12.1f}'.format(
+                name, phase, stats['p50_ms'], stats['p99_ms'], stats['peak_kb']))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the turn latency of PyWar code.')
+    parser.add_argument('-d', '--directory', metavar='DIR', type=str, default=CODE_DIRECTORY,
+                        help='Directory of the code to benchmark.')
+    parser.add_argument('--tactical-module', metavar='MODULE', type=str, default='simple_tactical',
+                        help='Tactical implementation module name.')
+    parser.add_argument('--strategic-module', metavar='MODULE', type=str, default='simple_strategic',
+                        help='Strategic implementation module name.')
+    parser.add_argument('--scenario', metavar='NAME', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run (may be given a few times). Defaults to all scenarios.')
+    parser.add_argument('-t', '--turns', metavar='TURNS', type=int, default=20,
+                        help='Amount of timed turns in each scenario.')
+    parser.add_argument('--memory-turns', metavar='TURNS', type=int, default=2,
+                        help='Amount of extra turns in each scenario for measuring memory.')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0,
+                        help='Random seed of the generated games.')
+    parser.add_argument('--save', metavar='PATH', type=str, default=None,
+                        help='Save the results as a JSON baseline.')
+    parser.add_argument('--compare', metavar='PATH', type=str, default=None,
+                        help='Compare the results with a JSON baseline.')
+    parser.add_argument('--threshold', metavar='RATIO', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative slowdown that is considered a regression.')
+    return parser.parse_args()
+
+
+def main(args):
+    results = {
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'scenarios': {},
+    }
+    for name in args.scenario or SCENARIOS:
+        print('Running', name, file=sys.stderr)
+        results['scenarios'][name] = run_scenario(args, name)
+    print_results(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('Regression:', regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    sys.exit(main(args))
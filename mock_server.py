@@ -0,0 +1,263 @@
+"""A local stand-in for the PyWar upload server.
+
+It implements the parts of the server used by `upload_script.py`, so uploads
+can be tested offline:
+* `POST /login` sets a session cookie if the password is right.
+* `GET /code/capabilities` answers whether delta uploads are accepted.
+* `POST /code/upload` accepts a full bundle, or a delta against a bundle it
+  already has (see `upload_script.Upload`). Unknown delta bases are
+  answered with `upload_script.DELTA_REJECTED`.
+
+Connections are kept alive between requests. The server may be told to fail
+the first few uploads with a 503 status, for testing retries.
+
+Uploaded bundles are kept in memory, by their hash. The server uses HTTPS with
+a self-signed certificate, generated using `openssl` unless one is given.
+"""
+import argparse
+import http.server
+import io
+import json
+import os.path
+import re
+import secrets
+import ssl
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import urllib.parse
+
+import upload_script
+
+DEFAULT_PASSWORD = 'password'
+
+
+class Upload:
+    """An upload received by the server.
+
+    This class exports the following fields:
+    * fields: The form fields of the upload (except the tarball).
+    * files: Maps the archive name of each file in the tarball to its content.
+    * bundle: The hash of the full bundle after the upload.
+    * delta: True iff the upload was a delta.
+    """
+
+    def __init__(self, fields, files, bundle, delta):
+        self.fields = fields
+        self.files = files
+        self.bundle = bundle
+        self.delta = delta
+
+
+class MockServer(http.server.ThreadingHTTPServer):
+    """The server, and the state of the uploads it has received."""
+
+    daemon_threads = True
+
+    def __init__(self, address, password=DEFAULT_PASSWORD, delta=True, ssl_context=None, fail_uploads=0):
+        super().__init__(address, MockRequestHandler)
+        self.password = password
+        self.delta = delta
+        self.fail_uploads = fail_uploads
+        self.connections = 0
+        self.sessions = set()
+        self.bundles = {}
+        self.uploads = []
+        self.lock = threading.Lock()
+        if ssl_context is not None:
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serves requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def parse_multipart(body, content_type):
+    """Returns the fields of a multipart body, as a dict mapping names to bytes.
+
+    Parts are separated by lines of the boundary, and their headers end with an
+    empty line, using `\\n` line endings as `upload_script.py` does.
+    """
+    boundary = content_type.split('boundary=', 1)[1].encode('utf8')
+    fields = {}
+    for part in body.split(b'--' + boundary)[1:]:
+        if part.startswith(b'--'):
+            break
+        headers, _, content = part.partition(b'\n\n')
+        name = re.search(rb'name="([^"]*)"', headers)
+        if name is not None:
+            fields[name.group(1).decode('utf8')] = content[:-1] if content.endswith(b'\n') else content
+    return fields
+
+
+def read_tarball(data):
+    files = {}
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tarball:
+        for member in tarball.getmembers():
+            if member.isfile():
+                files[member.name] = tarball.extractfile(member).read()
+    return files
+
+
+def hash_files(files):
+    return upload_script.hash_bundle({name: upload_script.hash_file(content) for name, content in files.items()})
+
+
+class MockRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _authorized(self):
+        cookie = self.headers.get('Cookie') or ''
+        return cookie.split(';')[0] in self.server.sessions
+
+    def do_POST(self):
+        if self.path == '/login':
+            self._login()
+        elif self.path == '/code/upload':
+            self._upload()
+        else:
+            self._respond(404)
+
+    def do_GET(self):
+        if self.path != '/code/capabilities':
+            self._respond(404)
+        elif not self._authorized():
+            self._respond(302, headers={'Location': '/login'})
+        else:
+            self._respond(200, json.dumps({'delta': self.server.delta}).encode('utf8'),
+                          {'Content-Type': 'application/json'})
+
+    def _login(self):
+        form = urllib.parse.parse_qs(self._read_body().decode('utf8'))
+        if form.get('password') != [self.server.password]:
+            self._respond(200, b'Wrong password')
+            return
+        session = 'session=' + secrets.token_hex(16)
+        with self.server.lock:
+            self.server.sessions.add(session)
+        self._respond(302, headers={'Location': '/', 'Set-Cookie': session})
+
+    def _upload(self):
+        if not self._authorized():
+            self._respond(302, headers={'Location': '/login'})
+            return
+        body = self._read_body()
+        with self.server.lock:
+            fail = self.server.fail_uploads > 0
+            if fail:
+                self.server.fail_uploads -= 1
+        if fail:
+            self._respond(503, b'Try again later')
+            return
+        fields = parse_multipart(body, self.headers['Content-type'])
+        try:
+            received = read_tarball(fields.pop('tarball'))
+        except (KeyError, tarfile.TarError, EOFError):
+            self._respond(400, b'Invalid tarball')
+            return
+        fields = {name: value.decode('utf8') for name, value in fields.items()}
+
+        delta = 'base' in fields
+        with self.server.lock:
+            if delta:
+                if not self.server.delta or fields['base'] not in self.server.bundles:
+                    self._respond(upload_script.DELTA_REJECTED, b'Unknown base bundle')
+                    return
+                files = dict(self.server.bundles[fields['base']])
+                for name in json.loads(fields.get('deleted', '[]')):
+                    files.pop(name, None)
+                files.update(received)
+            else:
+                files = received
+            bundle = hash_files(files)
+            if delta and fields.get('bundle') != bundle:
+                self._respond(400, b'Bundle hash mismatch')
+                return
+            self.server.bundles[bundle] = files
+            self.server.uploads.append(Upload(fields, received, bundle, delta))
+        self._respond(302, headers={'Location': '/code'})
+
+
+def make_self_signed_context(directory):
+    """Returns a server SSL context, using a new self-signed certificate."""
+    certfile = os.path.join(directory, 'cert.pem')
+    keyfile = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+                    '-subj', '/CN=localhost', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return make_ssl_context(certfile, keyfile)
+
+
+def make_ssl_context(certfile, keyfile):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the PyWar upload server.')
+    parser.add_argument('-p', '--port', metavar='PORT', type=int, default=2222,
+                        help='Port to listen on.')
+    parser.add_argument('--password', metavar='PASSWORD', type=str, default=DEFAULT_PASSWORD,
+                        help='Password for logging in to the server.')
+    parser.add_argument('--no-delta', action='store_true',
+                        help='Do not accept delta uploads.')
+    parser.add_argument('--fail-uploads', metavar='COUNT', type=int, default=0,
+                        help='Fail the first COUNT uploads with a 503 status.')
+    parser.add_argument('--certfile', metavar='PATH', type=str, default=None,
+                        help='Certificate file. A self-signed one is generated by default.')
+    parser.add_argument('--keyfile', metavar='PATH', type=str, default=None,
+                        help='Private key file of the certificate.')
+    return parser.parse_args()
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as directory:
+        if args.certfile is not None:
+            ssl_context = make_ssl_context(args.certfile, args.keyfile)
+        else:
+            ssl_context = make_self_signed_context(directory)
+        server = MockServer(('localhost', args.port), args.password, not args.no_delta, ssl_context,
+                            args.fail_uploads)
+        print('Serving on port', server.port, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print('Connections:', server.connections, file=sys.stderr)
+        for upload in server.uploads:
+            print('{} upload of {!r}: {} files, bundle {}'.format(
+                'Delta' if upload.delta else 'Full', upload.fields.get('name'), len(upload.files), upload.bundle))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
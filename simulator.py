@@ -0,0 +1,630 @@
+"""Offline, headless PyWar game simulator.
+
+This module runs strategy code locally, without uploading it to the PyWar
+server. Every turn it builds real `tactical_api.TurnContext`, `Tile` and piece
+objects for each country, hands them to the uploaded tactical/strategic modules
+exactly like the server does, and then resolves the commands that were given.
+
+The rules are a simplified, deterministic version of the server rules:
+* Every piece may be given one command per turn. If a piece receives a few
+  commands, the last one wins.
+* Ground pieces and landed flying pieces move to an adjacent tile. Flying
+  pieces in the air may move up to `FLIGHT_SPEED` tiles.
+* A tank attack conquers its tile, unless an enemy tank stands on it. In that
+  case one of the enemy tanks is destroyed instead. Enemy pieces standing on a
+  conquered tile are destroyed.
+* Airplanes (in the air), artilleries and helicopters (in the air) destroy one
+  enemy piece on the attacked tile, unless it is protected by an active enemy
+  iron dome.
+* Builders collect and throw money, and build pieces, only on tiles owned by
+  their country.
+
+The game is deterministic for a given seed, so it can be used for profiling and
+for comparing strategies.
+"""
+import argparse
+import collections
+import importlib.util
+import os
+import os.path
+import random
+import sys
+import time
+
+CODE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Code')
+# Simulated games do not update the command duration statistics of the code (see
+# Code/estimates.py), unless a file for them is given explicitly.
+os.environ.setdefault('PYWARS_ESTIMATES', 'off')
+if CODE_DIRECTORY not in sys.path:
+    sys.path.insert(0, CODE_DIRECTORY)
+
+import tactical_api  # noqa: E402
+from common_types import Coordinates, distance  # noqa: E402
+
+PRICES = {
+    'builder': 20,
+    'tank': 8,
+    'artillery': 8,
+    'airplane': 20,
+    'helicopter': 16,
+    'antitank': 10,
+    'irondome': 32,
+    'bunker': 10,
+    'spy': 20,
+    'tower': 16,
+    'satellite': 64,
+}
+FLIGHT_SPEED = 3
+ARTILLERY_RANGE = 3
+HELICOPTER_RANGE = 2
+IRON_DOME_RADIUS = 2
+SIGHT_RADIUS = 2
+START_TERRITORY_RADIUS = 2
+MAX_TILE_MONEY = 10
+
+
+class PieceState:
+    """The server-side state of a single piece."""
+
+    __slots__ = ('id', 'type', 'country', 'coordinates', 'money', 'in_air',
+                 'time_in_air', 'is_defending')
+
+    def __init__(self, piece_id, piece_type, country, coordinates):
+        self.id = piece_id
+        self.type = piece_type
+        self.country = country
+        self.coordinates = coordinates
+        self.money = 0
+        self.in_air = False
+        self.time_in_air = None
+        self.is_defending = False
+
+
+def _coordinates_of(destination):
+    if isinstance(destination, tactical_api.Tile):
+        return destination.coordinates
+    return Coordinates(destination[0], destination[1])
+
+
+class SimTile(tactical_api.Tile):
+    def __init__(self, coordinates, money, country):
+        self.coordinates = coordinates
+        self.money = money
+        self.country = country
+        self.pieces = []
+
+
+class SimPiece:
+    """The state shared by all the simulated game pieces.
+
+    The commands of the pieces are the methods of the `tactical_api` classes,
+    which give orders through `_order` (see `ORDER_METHODS`).
+    """
+
+    def __init__(self, context, tile, state):
+        self._context = context
+        self.id = state.id
+        self.type = state.type
+        self.country = state.country
+        self.tile = tile
+
+    def _order(self, command, *args):
+        self._context._order(self, command, args)
+
+
+def _order(command, *fixed_args):
+    def method(self):
+        self._order(command, *fixed_args)
+    return method
+
+
+def _order_at(command):
+    def method(self, destination):
+        self._order(command, _coordinates_of(destination))
+    return method
+
+
+def _order_amount(command):
+    def method(self, amount):
+        self._order(command, amount)
+    return method
+
+
+# Maps each `tactical_api` class to the command methods given to it. These are
+# set on the classes themselves rather than on the simulated subclasses, since
+# the bots may call them unbound (such as `Builder.build_tank(builder)`).
+ORDER_METHODS = {
+    tactical_api.BasePiece: {'move': _order_at('move')},
+    tactical_api.FlyingPiece: {'take_off': _order('take_off'), 'land': _order('land')},
+    tactical_api.Tank: {'attack': _order('attack')},
+    tactical_api.Airplane: {'attack': _order('attack')},
+    tactical_api.Artillery: {'attack': _order_at('attack')},
+    tactical_api.Helicopter: {'attack': _order_at('attack')},
+    tactical_api.IronDome: {
+        'turn_on_protection': _order('turn_on_protection'),
+        'turn_off_protection': _order('turn_off_protection'),
+    },
+    tactical_api.Builder: {
+        'collect_money': _order_amount('collect_money'),
+        'throw_money': _order_amount('throw_money'),
+        'build_tank': _order('build', 'tank'),
+        'build_airplane': _order('build', 'airplane'),
+        'build_artillery': _order('build', 'artillery'),
+        'build_helicopter': _order('build', 'helicopter'),
+        'build_antitank': _order('build', 'antitank'),
+        'build_iron_dome': _order('build', 'irondome'),
+        'build_bunker': _order('build', 'bunker'),
+        'build_spy': _order('build', 'spy'),
+        'build_tower': _order('build', 'tower'),
+        'build_satellite': _order('build', 'satellite'),
+        'build_builder': _order('build', 'builder'),
+    },
+}
+for api_class, methods in ORDER_METHODS.items():
+    for name, method in methods.items():
+        method.__name__ = name
+        method.__qualname__ = f'{api_class.__name__}.{name}'
+        method.__doc__ = getattr(api_class, name).__doc__
+        setattr(api_class, name, method)
+
+
+class SimFlyingPiece(SimPiece):
+    def __init__(self, context, tile, state):
+        super().__init__(context, tile, state)
+        self.in_air = state.in_air
+        self.time_in_air = state.time_in_air
+
+
+class SimTank(SimPiece, tactical_api.Tank):
+    pass
+
+
+class SimAirplane(SimFlyingPiece, tactical_api.Airplane):
+    pass
+
+
+class SimArtillery(SimPiece, tactical_api.Artillery):
+    pass
+
+
+class SimHelicopter(SimFlyingPiece, tactical_api.Helicopter):
+    pass
+
+
+class SimAntitank(SimPiece, tactical_api.Antitank):
+    pass
+
+
+class SimIronDome(SimPiece, tactical_api.IronDome):
+    def __init__(self, context, tile, state):
+        super().__init__(context, tile, state)
+        self.is_defending = state.is_defending
+
+
+class SimBunker(SimPiece, tactical_api.Bunker):
+    pass
+
+
+class SimSpy(SimPiece, tactical_api.Spy):
+    pass
+
+
+class SimTower(SimPiece, tactical_api.Tower):
+    pass
+
+
+class SimSatellite(SimPiece, tactical_api.Satellite):
+    pass
+
+
+class SimBuilder(SimPiece, tactical_api.Builder):
+    def __init__(self, context, tile, state):
+        super().__init__(context, tile, state)
+        self.money = state.money
+
+
+TYPE_TO_CLASS = {
+    'tank': SimTank,
+    'airplane': SimAirplane,
+    'artillery': SimArtillery,
+    'helicopter': SimHelicopter,
+    'antitank': SimAntitank,
+    'irondome': SimIronDome,
+    'bunker': SimBunker,
+    'spy': SimSpy,
+    'tower': SimTower,
+    'satellite': SimSatellite,
+    'builder': SimBuilder,
+}
+
+
+class SimTurnContext(tactical_api.TurnContext):
+    """A `TurnContext` of a single country, as built by the simulator.
+
+    Tiles are snapshots taken when the turn began. Money is visible only on
+    tiles owned by the country, or on tiles where one of its pieces stands.
+    """
+
+    def __init__(self, game, country):
+        self._game = game
+        self._orders = collections.defaultdict(list)
+        self._log = game.logs[country]
+        self.my_country = country
+        self.all_countries = list(game.countries)
+        self.game_width = game.width
+        self.game_height = game.height
+
+        occupied = {state.coordinates for state in game.pieces.values()
+                    if state.country == country}
+        self.tiles = {}
+        owners = game.owners
+        money = game.money
+        for coordinates in game.all_coordinates:
+            owner = owners[coordinates]
+            visible = owner == country or coordinates in occupied
+            self.tiles[coordinates] = SimTile(
+                coordinates, money[coordinates] if visible else None, owner)
+
+        self.my_pieces = {}
+        self.all_pieces = {}
+        for state in game.pieces.values():
+            tile = self.tiles[state.coordinates]
+            piece = TYPE_TO_CLASS[state.type](self, tile, state)
+            tile.pieces.append(piece)
+            self.all_pieces[piece.id] = piece
+            if state.country == country:
+                self.my_pieces[piece.id] = piece
+
+    def _order(self, piece, command, args):
+        if piece.country != self.my_country:
+            self.log(f'Ignoring {command} of piece {piece.id}, which is not ours')
+            return
+        self._orders[piece.id].append((command, args))
+
+    def get_tiles_of_country(self, country_name):
+        return set(self._game.territories.get(country_name, ()))
+
+    def get_sighings_of_piece(self, piece_id):
+        piece = self.my_pieces[piece_id]
+        location = piece.tile.coordinates
+        return {(other.id, other.tile.coordinates)
+                for other in self.all_pieces.values()
+                if other.country != self.my_country
+                and distance(location, other.tile.coordinates) <= SIGHT_RADIUS}
+
+    def get_commands_of_piece(self, piece_id):
+        return [command for command, _ in self._orders.get(piece_id, [])]
+
+    def log(self, log_entry):
+        self._log.append(log_entry)
+
+
+# Modules of the game API, which are shared by all the bots and the simulator.
+FRAMEWORK_MODULES = ('common_types', 'tactical_api', 'strategic_api')
+
+
+def load_bot(directory, module_name, instance_name):
+    """Loads a private copy of a bot module.
+
+    Every country gets its own copy, so module-level state is never shared
+    between countries that run the same code.
+    """
+    path = os.path.join(directory, module_name + '.py')
+    spec = importlib.util.spec_from_file_location(f'{module_name}__{instance_name}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _is_helper_module(module, directory):
+    """Returns True iff the module is a non-framework module loaded from the directory."""
+    path = getattr(module, '__file__', None)
+    return (path is not None and os.path.dirname(os.path.abspath(path)) == os.path.abspath(directory)
+            and module.__name__ not in FRAMEWORK_MODULES)
+
+
+class Bot:
+    """A country played by uploaded tactical and strategic modules."""
+
+    def __init__(self, directory, tactical_module, strategic_module, instance_name):
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        # Helper modules imported by the bot (such as `board`) hold per-game
+        # state too, so they are imported afresh for every bot, and then removed
+        # from `sys.modules`. The bot keeps its own references to them.
+        shared = {name: module for name, module in sys.modules.items()
+                  if _is_helper_module(module, directory)}
+        for name in shared:
+            del sys.modules[name]
+        try:
+            self.tactical = load_bot(directory, tactical_module, instance_name)
+            self.strategic = load_bot(directory, strategic_module, instance_name)
+        finally:
+            for name, module in list(sys.modules.items()):
+                if _is_helper_module(module, directory):
+                    del sys.modules[name]
+            sys.modules.update(shared)
+
+    def play(self, context):
+        strategic = self.tactical.get_strategic_implementation(context)
+        self.strategic.do_turn(strategic)
+
+
+class Game:
+    """The full state of a simulated game."""
+
+    def __init__(self, width, height, countries, pieces_per_country=4, seed=0,
+                 territory_radius=START_TERRITORY_RADIUS):
+        self.width = width
+        self.height = height
+        self.countries = [f'country{i}' for i in range(countries)]
+        self.turn = 0
+        self.random = random.Random(seed)
+        self.all_coordinates = [Coordinates(x, y) for x in range(width) for y in range(height)]
+        self.owners = dict.fromkeys(self.all_coordinates)
+        self.money = {coordinates: self.random.randint(0, MAX_TILE_MONEY)
+                      for coordinates in self.all_coordinates}
+        self.territories = {None: set(self.all_coordinates)}
+        self.territories.update((country, set()) for country in self.countries)
+        self.pieces = {}
+        self.locations = collections.defaultdict(set)
+        self.logs = {country: [] for country in self.countries}
+        self.bots = {}
+        self.errors = collections.Counter()
+        self._next_piece_id = 0
+
+        for country, center in zip(self.countries, self._start_locations()):
+            self._place_country(country, center, pieces_per_country, territory_radius)
+
+    def _start_locations(self):
+        columns = max(1, int(len(self.countries) ** 0.5 + 0.999))
+        rows = (len(self.countries) + columns - 1) // columns
+        for i in range(len(self.countries)):
+            row, column = divmod(i, columns)
+            yield Coordinates((2 * column + 1) * self.width // (2 * columns),
+                              (2 * row + 1) * self.height // (2 * rows))
+
+    def _place_country(self, country, center, pieces_per_country, territory_radius):
+        territory = [coordinates for coordinates in self.all_coordinates
+                     if distance(coordinates, center) <= territory_radius]
+        for coordinates in territory:
+            self._set_owner(coordinates, country)
+        self.add_piece('builder', country, center)
+        for _ in range(pieces_per_country - 1):
+            self.add_piece('tank', country, self.random.choice(territory))
+
+    def _set_owner(self, coordinates, country):
+        self.territories[self.owners[coordinates]].discard(coordinates)
+        self.territories[country].add(coordinates)
+        self.owners[coordinates] = country
+
+    def in_bounds(self, coordinates):
+        return 0 <= coordinates.x < self.width and 0 <= coordinates.y < self.height
+
+    def add_piece(self, piece_type, country, coordinates):
+        state = PieceState(str(self._next_piece_id), piece_type, country, coordinates)
+        self._next_piece_id += 1
+        self.pieces[state.id] = state
+        self.locations[coordinates].add(state.id)
+        return state
+
+    def remove_piece(self, state):
+        del self.pieces[state.id]
+        self.locations[state.coordinates].discard(state.id)
+
+    def set_bot(self, country, bot):
+        self.bots[country] = bot
+
+    def make_context(self, country):
+        """Builds the `TurnContext` that `country` sees in the current turn."""
+        return SimTurnContext(self, country)
+
+    # ----------------------------------------------------------------------------
+    # Command resolution.
+    # ----------------------------------------------------------------------------
+
+    def _enemies_at(self, country, coordinates):
+        pieces = [self.pieces[piece_id] for piece_id in sorted(self.locations[coordinates], key=int)]
+        return [state for state in pieces if state.country != country]
+
+    def _is_protected(self, country, coordinates):
+        return any(state.type == 'irondome' and state.is_defending and state.country != country
+                   and distance(state.coordinates, coordinates) <= IRON_DOME_RADIUS
+                   for state in self.pieces.values())
+
+    def _destroy_one(self, country, coordinates):
+        enemies = self._enemies_at(country, coordinates)
+        if enemies and not self._is_protected(country, coordinates):
+            self.remove_piece(enemies[0])
+
+    def _do_move(self, state, destination):
+        max_distance = FLIGHT_SPEED if state.in_air else 1
+        if not self.in_bounds(destination) or distance(state.coordinates, destination) > max_distance:
+            return False
+        self.locations[state.coordinates].discard(state.id)
+        self.locations[destination].add(state.id)
+        state.coordinates = destination
+        return True
+
+    def _do_attack(self, state, destination=None):
+        if state.type == 'tank':
+            enemies = self._enemies_at(state.country, state.coordinates)
+            enemy_tanks = [enemy for enemy in enemies if enemy.type == 'tank']
+            if enemy_tanks:
+                self.remove_piece(enemy_tanks[0])
+                return True
+            for enemy in enemies:
+                if not enemy.in_air:
+                    self.remove_piece(enemy)
+            self._set_owner(state.coordinates, state.country)
+        elif state.type == 'airplane':
+            if not state.in_air:
+                return False
+            self._destroy_one(state.country, state.coordinates)
+        else:
+            attack_range = ARTILLERY_RANGE if state.type == 'artillery' else HELICOPTER_RANGE
+            if state.type == 'helicopter' and not state.in_air:
+                return False
+            if not self.in_bounds(destination) or distance(state.coordinates, destination) > attack_range:
+                return False
+            self._destroy_one(state.country, destination)
+        return True
+
+    def _do_collect_money(self, state, amount):
+        if self.owners[state.coordinates] != state.country:
+            return False
+        amount = max(0, min(amount, self.money[state.coordinates]))
+        self.money[state.coordinates] -= amount
+        state.money += amount
+        return True
+
+    def _do_throw_money(self, state, amount):
+        amount = max(0, min(amount, state.money))
+        state.money -= amount
+        self.money[state.coordinates] += amount
+        return True
+
+    def _do_build(self, state, piece_type):
+        price = PRICES[piece_type]
+        if self.owners[state.coordinates] != state.country or state.money < price:
+            return False
+        state.money -= price
+        self.add_piece(piece_type, state.country, state.coordinates)
+        return True
+
+    def _do_take_off(self, state):
+        state.in_air = True
+        state.time_in_air = 0
+        return True
+
+    def _do_land(self, state):
+        state.in_air = False
+        state.time_in_air = None
+        return True
+
+    def _do_turn_on_protection(self, state):
+        state.is_defending = True
+        return True
+
+    def _do_turn_off_protection(self, state):
+        state.is_defending = False
+        return True
+
+    def apply_orders(self, context):
+        """Resolves all the commands given through `context` in this turn."""
+        for piece_id, orders in context._orders.items():
+            state = self.pieces.get(piece_id)
+            if state is None:
+                continue
+            command, args = orders[-1]
+            if not getattr(self, f'_do_{command}')(state, *args):
+                self.errors[command] += 1
+
+    def _play_idle(self, country):
+        """Moves the tanks of a country without a bot to random tiles."""
+        for state in list(self.pieces.values()):
+            if state.country != country or state.type != 'tank' or state.id not in self.pieces:
+                continue
+            if self.owners[state.coordinates] != country:
+                self._do_attack(state)
+                continue
+            x, y = state.coordinates
+            self._do_move(state, self.random.choice([
+                Coordinates(x + 1, y), Coordinates(x - 1, y),
+                Coordinates(x, y + 1), Coordinates(x, y - 1),
+            ]))
+
+    def play_turn(self):
+        """Plays a single turn of all the countries.
+
+        Returns a dict, mapping each country played by a bot to the time (in
+        seconds) its code took.
+        """
+        durations = {}
+        offset = self.turn % len(self.countries)
+        for country in self.countries[offset:] + self.countries[:offset]:
+            bot = self.bots.get(country)
+            if bot is None:
+                self._play_idle(country)
+                continue
+            context = self.make_context(country)
+            start = time.perf_counter()
+            try:
+                bot.play(context)
+            except Exception as e:
+                context.log(f'Exception in turn {self.turn}: {e!r}')
+                self.errors['exception'] += 1
+            durations[country] = time.perf_counter() - start
+            self.apply_orders(context)
+
+        for state in self.pieces.values():
+            if state.in_air:
+                state.time_in_air += 1
+        self.turn += 1
+        return durations
+
+    def alive_countries(self):
+        return [country for country in self.countries
+                if self.territories[country] or any(state.country == country
+                                                    for state in self.pieces.values())]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Simulate a PyWar game locally.')
+    parser.add_argument('-d', '--directory', metavar='DIR', type=str, default=CODE_DIRECTORY,
+                        help='Directory of the code to simulate.')
+    parser.add_argument('--tactical-module', metavar='MODULE', type=str, default='simple_tactical',
+                        help='Tactical implementation module name.')
+    parser.add_argument('--strategic-module', metavar='MODULE', type=str, default='simple_strategic',
+                        help='Strategic implementation module name.')
+    parser.add_argument('--width', metavar='WIDTH', type=int, default=30,
+                        help='Width of the game board.')
+    parser.add_argument('--height', metavar='HEIGHT', type=int, default=30,
+                        help='Height of the game board.')
+    parser.add_argument('-c', '--countries', metavar='COUNT', type=int, default=2,
+                        help='Amount of countries in the game.')
+    parser.add_argument('-b', '--bots', metavar='COUNT', type=int, default=1,
+                        help='Amount of countries played by the code (the rest are idle).')
+    parser.add_argument('--pieces', metavar='COUNT', type=int, default=4,
+                        help='Amount of starting pieces of each country.')
+    parser.add_argument('-t', '--turns', metavar='TURNS', type=int, default=100,
+                        help='Amount of turns to simulate.')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0,
+                        help='Random seed of the game.')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Print the logs of the countries.')
+    return parser.parse_args()
+
+
+def main(args):
+    random.seed(args.seed)
+    game = Game(args.width, args.height, args.countries, args.pieces, args.seed)
+    for country in game.countries[:args.bots]:
+        game.set_bot(country, Bot(args.directory, args.tactical_module, args.strategic_module, country))
+
+    durations = collections.defaultdict(list)
+    for _ in range(args.turns):
+        for country, duration in game.play_turn().items():
+            durations[country].append(duration)
+        if len(game.alive_countries()) <= 1:
+            break
+
+    print(f'Played {game.turn} turns')
+    for country in game.countries:
+        pieces = sum(1 for state in game.pieces.values() if state.country == country)
+        line = f'{country}: {len(game.territories[country])} tiles, {pieces} pieces'
+        if durations[country]:
+            line += ', {:.2f}ms average turn, {:.2f}ms max turn'.format(
+                1000 * sum(durations[country]) / len(durations[country]),
+                1000 * max(durations[country]))
+        print(line)
+        if args.verbose:
+            for entry in game.logs[country]:
+                print('   ', entry)
+    if game.errors:
+        print('Rejected commands:', dict(game.errors))
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    main(args)
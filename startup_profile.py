@@ -0,0 +1,391 @@
+"""Startup profiler of the strategy code.
+
+The first turn of a game also pays for importing the code and for building
+its module-level state. This tool measures:
+* imports: The cold import time of every module, in a fresh interpreter which
+  imports the tactical and strategic modules from a clean copy of the code
+  directory (without byte-compiled files), using `python -X importtime`.
+* state: The deep size of the module-level globals of every module of the
+  code, after importing it and after the first turn.
+* first turn: The time of the phases of the first turn (see `benchmark.py`),
+  compared with the median of the following turns.
+* deferrable: Heavy external modules imported at the top level of modules of
+  the code, but only used inside their functions, so they could be imported
+  lazily.
+
+Results can be saved as JSON, and compared against the results of another
+commit in order to flag regressions.
+"""
+import argparse
+import ast
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import types
+
+from benchmark import SCENARIOS, TimedBot, make_game
+from simulator import CODE_DIRECTORY
+from upload_script import extract_bundle, list_directory
+
+DEFAULT_SCENARIO = '100x100'
+DEFAULT_THRESHOLD = 0.2
+# Cumulative import time (in milliseconds) of modules considered heavy.
+DEFAULT_HEAVY_MS = 5.0
+# Values smaller than this (milliseconds or KB) are never considered regressions.
+MIN_COMPARED = 1.0
+IMPORT_SCRIPT = 'import sys\nfor module in sys.argv[1:]:\n    __import__(module)\n'
+IMPORT_TIME_PREFIX = 'import time:'
+# Globals of these types are code rather than state.
+CODE_TYPES = (types.ModuleType, type, types.FunctionType, types.BuiltinFunctionType,
+              types.MethodType, types.CodeType)
+
+
+def parse_import_times(output):
+    """Returns a dict mapping each module in `-X importtime` output to its (self, cumulative) ms."""
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith(IMPORT_TIME_PREFIX):
+            continue
+        fields = line[len(IMPORT_TIME_PREFIX):].split('|')
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (ValueError, IndexError):
+            # The header line.
+            continue
+        times[fields[2].strip()] = (self_us / 1000, cumulative_us / 1000)
+    return times
+
+
+def measure_imports(args):
+    """Returns the median cold import times of all the modules, as a dict of dicts."""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        extract_bundle(list_directory(args.directory), directory)
+        for _ in range(args.runs):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_SCRIPT,
+                                     args.tactical_module, args.strategic_module],
+                                    cwd=directory, env=env, capture_output=True, text=True, check=True)
+            runs.append(parse_import_times(result.stderr))
+    imports = {}
+    for module in runs[0]:
+        samples = [run[module] for run in runs if module in run]
+        imports[module] = {
+            'self_ms': statistics.median(sample[0] for sample in samples),
+            'cumulative_ms': statistics.median(sample[1] for sample in samples),
+        }
+    return imports
+
+
+def get_local_modules(directory):
+    """Returns a dict mapping the names of the modules of the code to their paths."""
+    return {filename[:-len('.py')]: os.path.join(directory, filename)
+            for filename in sorted(os.listdir(directory)) if filename.endswith('.py')}
+
+
+def get_top_level_imports(tree):
+    """Returns a dict mapping each name bound by a top-level import to the imported module.
+
+    Imports inside top-level `try` and `if` blocks are also top-level.
+    """
+    imports = {}
+    pending = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname is None:
+                    imports[alias.name.split('.')[0]] = alias.name
+                else:
+                    imports[alias.asname] = alias.name
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            for alias in node.names:
+                imports[alias.asname or alias.name] = node.module
+        elif isinstance(node, (ast.Try, ast.If)):
+            pending.extend(node.body)
+            pending.extend(node.orelse)
+            pending.extend(getattr(node, 'finalbody', []))
+            for handler in getattr(node, 'handlers', []):
+                pending.extend(handler.body)
+    return imports
+
+
+def get_module_level_names(tree):
+    """Returns the names read while executing the module, outside of function bodies.
+
+    Decorators and default values of functions are evaluated at import time,
+    and so are annotations unless `from __future__ import annotations` is used.
+    Assigned names do not count, such as `np = None` in an ImportError fallback.
+    """
+    lazy_annotations = any(isinstance(node, ast.ImportFrom) and node.module == '__future__'
+                           and any(alias.name == 'annotations' for alias in node.names)
+                           for node in tree.body)
+    names = set()
+    pending = list(tree.body)
+    while pending:
+        node = pending.pop()
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Load):
+                names.add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)):
+            pending.extend(getattr(node, 'decorator_list', []))
+            pending.extend(node.args.defaults)
+            pending.extend(default for default in node.args.kw_defaults if default is not None)
+            if not lazy_annotations and not isinstance(node, ast.Lambda):
+                arguments = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+                pending.extend(arg.annotation for arg in arguments if arg.annotation is not None)
+                if node.returns is not None:
+                    pending.append(node.returns)
+        elif not isinstance(node, (ast.Import, ast.ImportFrom)):
+            pending.extend(ast.iter_child_nodes(node))
+    return names
+
+
+def find_deferrable_imports(directory, imports, heavy_ms):
+    """Returns descriptions of heavy external modules, which could be imported lazily.
+
+    Modules of the code are never reported, as deferring them saves nothing
+    while other modules of the code import them anyway. An external module is
+    reported only if all the modules of the code importing it at the top level
+    use it only inside functions.
+    """
+    local_modules = get_local_modules(directory)
+    # Maps each external module to the modules of the code importing it, and
+    # whether any of them uses it at the top level.
+    importers = {}
+    used_anywhere = set()
+    for module, path in local_modules.items():
+        if module not in imports:
+            continue
+        with open(path, 'rb') as source_file:
+            tree = ast.parse(source_file.read())
+        used = get_module_level_names(tree)
+        for name, imported in get_top_level_imports(tree).items():
+            if imported.split('.')[0] in local_modules or imported == '__future__':
+                continue
+            importers.setdefault(imported, set()).add(module)
+            if name in used:
+                used_anywhere.add(imported)
+    deferrable = []
+    for imported, modules in importers.items():
+        stats = imports.get(imported) or imports.get(imported.split('.')[0])
+        if stats is None or stats['cumulative_ms'] < heavy_ms or imported in used_anywhere:
+            continue
+        deferrable.append((stats['cumulative_ms'], '{} ({:.1f} ms): only used inside functions of {}'.format(
+            imported, stats['cumulative_ms'], ', '.join(sorted(modules)))))
+    return [description for _, description in sorted(deferrable, reverse=True)]
+
+
+def deep_size(value, seen):
+    """Returns the size in bytes of the value and everything it references, excluding code and `seen`."""
+    size = 0
+    pending = [value]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, CODE_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        pending.extend(gc.get_referents(obj))
+    return size
+
+
+def get_bot_namespaces(bot, directory):
+    """Returns the globals of the modules of the code loaded by the bot, by module name.
+
+    The bot keeps private copies of its modules, which are not in `sys.modules`,
+    so they are found by following the modules, functions and classes
+    referenced by the globals of its tactical and strategic modules.
+    """
+    directory = os.path.abspath(directory)
+    namespaces = {}
+    pending = [vars(bot.tactical), vars(bot.strategic)]
+    while pending:
+        namespace = pending.pop()
+        path = namespace.get('__file__')
+        if path is None or os.path.dirname(os.path.abspath(path)) != directory:
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in namespaces:
+            continue
+        namespaces[name] = namespace
+        for value in namespace.values():
+            if isinstance(value, types.ModuleType):
+                pending.append(vars(value))
+            elif isinstance(value, types.FunctionType):
+                pending.append(value.__globals__)
+            elif isinstance(value, type):
+                pending.extend(attribute.__globals__ for attribute in vars(value).values()
+                               if isinstance(attribute, types.FunctionType))
+    return namespaces
+
+
+def measure_state(namespaces, excluded):
+    """Returns the deep size in KB of the module-level state of each module.
+
+    Objects whose ids are in `excluded` (such as the simulated game) are not
+    counted, nor is anything referenced only through them.
+    """
+    sizes = {}
+    for name, namespace in sorted(namespaces.items()):
+        seen = set(excluded)
+        size = 0
+        for key, value in namespace.items():
+            if not key.startswith('__'):
+                size += deep_size(value, seen)
+        sizes[name] = size / 1024
+    return sizes
+
+
+class StartupBot(TimedBot):
+    """A bot that keeps the contexts of its turns, so they are excluded from its state."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.contexts = []
+
+    def play(self, context):
+        self.contexts.append(context)
+        super().play(context)
+
+
+def measure_turns(args):
+    """Returns the state sizes of the modules, and the times of the first turn."""
+    width, height, countries, pieces, territory_radius = SCENARIOS[args.scenario]
+    game = make_game(width, height, countries, pieces, territory_radius, args.seed)
+    bot = StartupBot(args.directory, args.tactical_module, args.strategic_module, 'startup')
+    game.set_bot(game.countries[0], bot)
+    namespaces = get_bot_namespaces(bot, args.directory)
+    excluded = {id(game)}
+    state_after_import = measure_state(namespaces, excluded)
+
+    game.play_turn()
+    excluded.update(id(context) for context in bot.contexts)
+    state_after_first_turn = measure_state(namespaces, excluded)
+    for _ in range(args.turns):
+        game.play_turn()
+
+    first_turn = {}
+    for phase in ('tactical', 'strategic', 'total'):
+        durations = bot.durations[phase]
+        first_turn[phase] = {
+            'first_ms': 1000 * durations[0],
+            'later_median_ms': 1000 * statistics.median(durations[1:]) if len(durations) > 1 else None,
+        }
+    state = {name: {'import_kb': state_after_import[name], 'first_turn_kb': state_after_first_turn[name]}
+             for name in namespaces}
+    return state, first_turn
+
+
+def compare(results, baseline, threshold):
+    """Returns a list of descriptions of regressions relative to the baseline."""
+    regressions = []
+
+    def walk(path, value, old_value):
+        if isinstance(value, dict):
+            if isinstance(old_value, dict):
+                for key in value:
+                    walk(path + [key], value[key], old_value.get(key))
+        elif isinstance(value, (int, float)) and isinstance(old_value, (int, float)):
+            if value >= MIN_COMPARED and value > old_value * (1 + threshold):
+                regressions.append('{}: {:.2f} -> {:.2f}'.format(' '.join(path), old_value, value))
+
+    for section in ('imports', 'state', 'first_turn'):
+        walk([section], results[section], baseline.get(section))
+    return regressions
+
+
+def get_commit(directory):
+    """Returns the current git commit of the directory, or None."""
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=directory, capture_output=True,
+                                text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def print_results(results, heavy_ms):
+    local_modules = set(results['state'])
+    print('{:<24} {:>12} {:>16}'.format('import', 'self (ms)', 'cumulative (ms)'))
+    for module, stats in sorted(results['imports'].items(), key=lambda item: -item[1]['cumulative_ms']):
+        if module in local_modules or ('.' not in module and stats['cumulative_ms'] >= heavy_ms):
+            print('{:<24} {:>12.2f} {:>16.2f}'.format(module, stats['self_ms'], stats['cumulative_ms']))
+    print()
+    print('{:<24} {:>12} {:>16}'.format('state', 'import (KB)', 'first turn (KB)'))
+    for module, stats in sorted(results['state'].items()):
+        print('{:<24} {:>12.1f} {:>16.1f}'.format(module, stats['import_kb'], stats['first_turn_kb']))
+    print()
+    print('{:<24} {:>12} {:>16}'.format('turn', 'first (ms)', 'later p50 (ms)'))
+    for phase, stats in results['first_turn'].items():
+        later = stats['later_median_ms']
+        print('{:<24} {:>12.2f} {:>16}'.format(phase, stats['first_ms'],
+                                                '-' if later is None else '{:.2f}'.format(later)))
+    for description in results['deferrable']:
+        print('Deferrable import:', description)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Profile the startup of PyWar code.')
+    parser.add_argument('-d', '--directory', metavar='DIR', type=str, default=CODE_DIRECTORY,
+                        help='Directory of the code to profile.')
+    parser.add_argument('--tactical-module', metavar='MODULE', type=str, default='simple_tactical',
+                        help='Tactical implementation module name.')
+    parser.add_argument('--strategic-module', metavar='MODULE', type=str, default='simple_strategic',
+                        help='Strategic implementation module name.')
+    parser.add_argument('--scenario', metavar='NAME', choices=list(SCENARIOS), default=DEFAULT_SCENARIO,
+                        help='Scenario (see benchmark.py) of the first turn.')
+    parser.add_argument('-t', '--turns', metavar='TURNS', type=int, default=5,
+                        help='Amount of turns after the first one, to compare it with.')
+    parser.add_argument('--runs', metavar='RUNS', type=int, default=5,
+                        help='Amount of cold imports to take the median of.')
+    parser.add_argument('--heavy', metavar='MS', type=float, default=DEFAULT_HEAVY_MS,
+                        help='Cumulative import time of modules considered heavy.')
+    parser.add_argument('--seed', metavar='SEED', type=int, default=0,
+                        help='Random seed of the generated game.')
+    parser.add_argument('--save', metavar='PATH', type=str, default=None,
+                        help='Save the results as JSON.')
+    parser.add_argument('--compare', metavar='PATH', type=str, default=None,
+                        help='Compare the results with saved JSON results.')
+    parser.add_argument('--threshold', metavar='RATIO', type=float, default=DEFAULT_THRESHOLD,
+                        help='Relative increase that is considered a regression.')
+    return parser.parse_args()
+
+
+def main(args):
+    imports = measure_imports(args)
+    state, first_turn = measure_turns(args)
+    results = {
+        'python': platform.python_version(),
+        'commit': get_commit(args.directory),
+        'scenario': args.scenario,
+        'imports': imports,
+        'state': state,
+        'first_turn': first_turn,
+        'deferrable': find_deferrable_imports(args.directory, imports, args.heavy),
+    }
+    print_results(results, args.heavy)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for regression in regressions:
+            print('Regression:', regression, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,9 @@
+import os.path
+import sys
+
+ROOT_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIRECTORY not in sys.path:
+    sys.path.insert(0, ROOT_DIRECTORY)
+CODE_DIRECTORY = os.path.join(ROOT_DIRECTORY, 'Code')
+if CODE_DIRECTORY not in sys.path:
+    sys.path.insert(0, CODE_DIRECTORY)
@@ -0,0 +1,9 @@
+from benchmark import percentile
+
+
+def test_percentile_nearest_rank():
+    assert percentile(range(1, 23), 50) == 11
+    assert percentile(range(1, 11), 50) == 5
+    assert percentile(range(1, 11), 99) == 10
+    assert percentile(range(1, 11), 100) == 10
+    assert percentile([7], 0) == 7
@@ -0,0 +1,73 @@
+import random
+
+import pytest
+
+import board
+import turn_state
+from simulator import Game, tactical_api
+
+OWNERS = ['country0', 'country1', None, board.ENEMIES, board.NOT_MINE]
+
+
+class OrderBot:
+    """A bot which calls a function with the context of every turn."""
+
+    def __init__(self, play):
+        self.play = play
+
+
+@pytest.fixture(params=[False, True], ids=['tiles', 'grid'])
+def use_grid(request, monkeypatch):
+    if request.param:
+        pytest.importorskip('numpy')
+    monkeypatch.setattr(board, 'USE_GRID', request.param)
+    monkeypatch.setattr(board, '_previous_owners', None)
+    monkeypatch.setattr(board, '_previous_distance_maps', {})
+    monkeypatch.setattr(turn_state, '_tracker', None)
+    return request.param
+
+
+def expected_distance(context, owner, coordinates):
+    my_country = context.my_country
+    sources = [tile for tile, state in context.tiles.items()
+               if board._is_owner(owner, state.country, my_country)]
+    if not sources:
+        return board.INFINITE_DISTANCE
+    return min(abs(x - coordinates[0]) + abs(y - coordinates[1]) for x, y in sources)
+
+
+def test_incremental_indexes_match_a_rebuild(use_grid):
+    game = Game(12, 12, 2, pieces_per_country=6, seed=1, territory_radius=3)
+    rng = random.Random(0)
+    checked = []
+
+    def play(context):
+        diff = turn_state.track_turn(context)
+        grid = board.get_board_grid(context)
+        assert (grid is not None) == use_grid
+        if grid is not None:
+            owners = grid.owners
+            for coordinates, tile in context.tiles.items():
+                assert owners[coordinates] == grid.country_ids[tile.country]
+        for owner in OWNERS:
+            distance_map = board.get_distance_map(context, owner)
+            for coordinates in context.tiles:
+                assert distance_map.distance(coordinates) == expected_distance(context, owner, coordinates)
+        checked.append(diff.full)
+
+        for piece in context.my_pieces.values():
+            if piece.type != 'tank':
+                continue
+            if rng.random() < 0.5:
+                tactical_api.Tank.attack(piece)
+            else:
+                x, y = piece.tile.coordinates
+                dx, dy = rng.choice([(1, 0), (-1, 0), (0, 1), (0, -1)])
+                if 0 <= x + dx < context.game_width and 0 <= y + dy < context.game_height:
+                    tactical_api.Tank.move(piece, tactical_api.Coordinates(x + dx, y + dy))
+
+    game.set_bot(game.countries[0], OrderBot(play))
+    for _ in range(8):
+        game.play_turn()
+    assert not game.errors
+    assert checked == [True] + [False] * 7
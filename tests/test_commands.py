@@ -0,0 +1,24 @@
+from commands import ATTACK, STALL_TURNS, CommandRegistry
+
+
+def test_progressing_attack_is_not_stalled():
+    registry = CommandRegistry()
+    # Issued with the L1 distance, while each turn estimates the path cost,
+    # which is higher as conquering a tile costs more than moving into it.
+    command = registry.issue(ATTACK, 'tank', 20)
+    estimates = iter(range(37, 37 - 2 * STALL_TURNS, -1))
+    for turn in range(1, 2 * STALL_TURNS):
+        registry.tick(turn, lambda command: next(estimates))
+        assert not command.stalled
+    assert registry.stalled() == []
+
+
+def test_attack_without_progress_is_stalled():
+    registry = CommandRegistry()
+    command = registry.issue(ATTACK, 'tank', 20)
+    for turn in range(1, STALL_TURNS + 1):
+        registry.tick(turn, lambda command: 30)
+        assert not command.stalled
+    registry.tick(STALL_TURNS + 1, lambda command: 30)
+    assert command.stalled
+    assert registry.stalled() == [command]
@@ -0,0 +1,50 @@
+from simulator import PRICES, Game, tactical_api
+
+
+class OrderBot:
+    """A bot which calls a function with the context of every turn."""
+
+    def __init__(self, play):
+        self.play = play
+
+
+def make_game():
+    return Game(10, 10, 2, pieces_per_country=0, seed=0)
+
+
+def pieces_of(game, country):
+    return [state for state in game.pieces.values() if state.country == country]
+
+
+def test_build_order_adds_a_piece():
+    game = make_game()
+    country = game.countries[0]
+    builder = game.add_piece('builder', country, sorted(game.territories[country])[0])
+    builder.money = PRICES['tank']
+    pieces = len(pieces_of(game, country))
+
+    def play(context):
+        # Like the bots, call the build method unbound on the base class.
+        tactical_api.Builder.build_tank(context.my_pieces[builder.id])
+
+    game.set_bot(country, OrderBot(play))
+    game.play_turn()
+    assert len(pieces_of(game, country)) == pieces + 1
+    assert pieces_of(game, country)[-1].type == 'tank'
+    assert builder.money == 0
+    assert not game.errors
+
+
+def test_move_order_moves_the_piece():
+    game = make_game()
+    country = game.countries[0]
+    territory = game.territories[country]
+    source = sorted(territory)[0]
+    destination = next(coordinates for coordinates in sorted(territory)
+                       if abs(coordinates.x - source.x) + abs(coordinates.y - source.y) == 1)
+    tank = game.add_piece('tank', country, source)
+
+    game.set_bot(country, OrderBot(lambda context: context.my_pieces[tank.id].move(destination)))
+    game.play_turn()
+    assert tank.coordinates == destination
+    assert not game.errors
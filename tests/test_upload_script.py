@@ -0,0 +1,147 @@
+import json
+import shutil
+import sys
+
+import pytest
+
+import mock_server
+import upload_script
+
+PASSWORD = 'password'
+
+pytestmark = pytest.mark.skipif(shutil.which('openssl') is None, reason='openssl is required for HTTPS')
+
+
+@pytest.fixture(scope='module')
+def ssl_context(tmp_path_factory):
+    return mock_server.make_self_signed_context(str(tmp_path_factory.mktemp('ssl')))
+
+
+@pytest.fixture
+def start_server(ssl_context):
+    servers = []
+
+    def start(**kwargs):
+        server = mock_server.MockServer(('localhost', 0), PASSWORD, ssl_context=ssl_context, **kwargs)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def code(tmp_path):
+    directory = tmp_path / 'Code'
+    directory.mkdir()
+    (directory / 'my_tactical.py').write_text('import helper\n')
+    (directory / 'my_strategic.py').write_text('def do_turn(strategic):\n    pass\n')
+    (directory / 'helper.py').write_text('VALUE = 1\n')
+    return directory
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(upload_script, 'RETRY_BACKOFF', 0)
+
+
+def run_upload_script(monkeypatch, server, code, *args):
+    monkeypatch.setattr(sys, 'argv', [
+        'upload_script.py', '-s', 'localhost', '-p', str(server.port),
+        '--tactical-module', 'my_tactical', '--strategic-module', 'my_strategic', '--password', PASSWORD,
+        '--manifest', str(code.parent / 'manifest.json'), *args,
+    ])
+    upload_script.main(upload_script.parse_args())
+
+
+def upload(monkeypatch, server, code, *extra_args):
+    run_upload_script(monkeypatch, server, code, '-d', str(code), '-n', 'test', *extra_args)
+
+
+def test_full_upload(monkeypatch, start_server, code):
+    server = start_server()
+    upload(monkeypatch, server, code)
+    [received] = server.uploads
+    assert not received.delta
+    assert received.fields['name'] == 'test'
+    assert set(received.files) == {'my_tactical.py', 'my_strategic.py', 'helper.py'}
+    assert server.connections == 1
+    manifest = json.loads((code.parent / 'manifest.json').read_text())
+    assert [entry['bundle'] for entry in manifest.values()] == [received.bundle]
+
+
+def test_unchanged_bundle_is_skipped(monkeypatch, start_server, code):
+    server = start_server()
+    upload(monkeypatch, server, code)
+    upload(monkeypatch, server, code)
+    assert len(server.uploads) == 1
+    upload(monkeypatch, server, code, '--force')
+    assert len(server.uploads) == 2
+
+
+def test_delta_upload(monkeypatch, start_server, code):
+    server = start_server()
+    upload(monkeypatch, server, code)
+    (code / 'helper.py').write_text('VALUE = 2\n')
+    (code / 'my_strategic.py').write_text('def do_turn(strategic):\n    return None\n')
+    upload(monkeypatch, server, code)
+    full, delta = server.uploads
+    assert delta.delta
+    assert set(delta.files) == {'helper.py', 'my_strategic.py'}
+    assert delta.fields['base'] == full.bundle
+    assert server.bundles[delta.bundle]['helper.py'] == b'VALUE = 2\n'
+    assert server.bundles[delta.bundle]['my_tactical.py'] == b'import helper\n'
+
+
+def test_rejected_delta_falls_back_to_full_upload(monkeypatch, capsys, start_server, code):
+    server = start_server()
+    upload(monkeypatch, server, code)
+    (code / 'helper.py').write_text('VALUE = 2\n')
+    # The server no longer knows the bundle the manifest refers to.
+    server.bundles.clear()
+    upload(monkeypatch, server, code)
+    assert 'delta rejected' in capsys.readouterr().out
+    received = server.uploads[-1]
+    assert not received.delta
+    assert set(received.files) == {'my_tactical.py', 'my_strategic.py', 'helper.py'}
+
+
+def test_transient_failures_are_retried(monkeypatch, start_server, code):
+    server = start_server(fail_uploads=upload_script.RETRIES - 1)
+    upload(monkeypatch, server, code)
+    assert len(server.uploads) == 1
+    assert server.fail_uploads == 0
+
+
+def test_bundles_are_told_apart_by_name(monkeypatch, start_server, code):
+    server = start_server()
+    upload(monkeypatch, server, code)
+    run_upload_script(monkeypatch, server, code, '--bundle', 'bar', str(code), '--bundle', 'baz', str(code))
+    assert sorted(received.fields['name'] for received in server.uploads) == ['bar', 'baz', 'test']
+    run_upload_script(monkeypatch, server, code, '--bundle', 'bar', str(code))
+    assert len(server.uploads) == 3
+
+
+def test_variants(monkeypatch, start_server, code, tmp_path):
+    other = tmp_path / 'Other'
+    shutil.copytree(str(code), str(other))
+    (other / 'helper.py').write_text('VALUE = 2\n')
+    variants = tmp_path / 'variants.json'
+    variants.write_text(json.dumps([
+        {'name': 'first', 'directory': str(code)},
+        {'name': 'second', 'directory': str(code)},
+        {'name': 'other', 'directory': str(other)},
+    ]))
+    server = start_server()
+    run_upload_script(monkeypatch, server, code, '--variants', str(variants))
+    received = {upload.fields['name']: upload for upload in server.uploads}
+    assert sorted(received) == ['first', 'other', 'second']
+    assert received['first'].bundle == received['second'].bundle != received['other'].bundle
+    manifest = json.loads((code.parent / 'manifest.json').read_text())
+    assert {key.rsplit(':', 1)[-1]: entry['bundle'] for key, entry in manifest.items()} == {
+        name: upload.bundle for name, upload in received.items()}
+    run_upload_script(monkeypatch, server, code, '--variants', str(variants))
+    assert len(server.uploads) == 3
@@ -1,12 +1,21 @@
 import argparse
+import ast
+import concurrent.futures
+import hashlib
 from getpass import getpass
 import http.client
 import io
+import json
 import os
 import os.path
+import queue
+import shutil
 import ssl
+import subprocess
 import sys
 import tarfile
+import tempfile
+import time
 import urllib.parse
 
 TIMEOUT = 10
@@ -17,14 +26,58 @@ BOUNDARY = b'wL36Yn8afVp8Ag7AmP8qZ0SA4n1v9T'
 UPLOAD_REQUEST_HEADERS = {
     'Content-type': 'multipart/form-data; boundary={}'.format(BOUNDARY)
 }
+CAPABILITIES_REQUEST_HEADERS = {
+    'Accept': 'application/json'
+}
+LOG_CONFIG_FILENAME = 'log_config.json'
+# Size of the chunks in which files are read, hashed and sent.
+CHUNK_SIZE = 64 * 1024
+# Names of files and directories which are never uploaded. The local command
+# duration statistics (see Code/estimates.py) are not uploaded either.
+IGNORED_NAMES = {'__pycache__', 'turn_estimates.json'}
+DEFAULT_MANIFEST = '.upload_manifest.json'
+UPLOAD_SUCCESS = 302
+# Returned by servers supporting delta uploads, when they do not know the base bundle.
+DELTA_REJECTED = 409
+# Statuses of responses to retry, as they usually mean a temporary failure.
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+RETRIES = 3
+# Seconds to wait before the first retry. Each retry waits twice longer.
+RETRY_BACKOFF = 1.0
+DEFAULT_JOBS = 4
+# Amount of cold imports to run when measuring the import time of a bundle.
+IMPORT_TIME_RUNS = 3
+# Compiles the modules named on stdin (one JSON object mapping each source to
+# its output and display names) in the target interpreter, and prints its tag.
+COMPILE_SCRIPT = """
+import json, py_compile, sys
+for source, (cfile, dfile) in json.load(sys.stdin).items():
+    py_compile.compile(source, cfile=cfile, dfile=dfile, doraise=True,
+                       invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+print(sys.implementation.cache_tag)
+"""
+IMPORT_TIME_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+for module in sys.argv[1:]:
+    __import__(module)
+print(time.perf_counter() - start)
+"""
 
 
 def parse_args():
     parser = argparse.ArgumentParser(description='Upload code to PyWar.')
-    parser.add_argument('-d', '--directory', metavar='DIR', type=str, required=True,
+    parser.add_argument('-d', '--directory', metavar='DIR', type=str, default=None,
                         help='Directory to upload.')
-    parser.add_argument('-n', '--name', metavar='NAME', type=str, required=True,
+    parser.add_argument('-n', '--name', metavar='NAME', type=str, default=None,
                         help='Code name in PyWar.')
+    parser.add_argument('--bundle', metavar=('NAME', 'DIR'), nargs=2, action='append', default=[],
+                        help='Upload DIR as NAME. May be given a few times, to upload a few bundles '
+                             'in one session (in addition to -d and -n, if given).')
+    parser.add_argument('--variants', metavar='PATH', type=str, default=None,
+                        help='JSON file listing strategy variants to upload (see load_variants).')
+    parser.add_argument('-j', '--jobs', metavar='COUNT', type=int, default=DEFAULT_JOBS,
+                        help='Amount of tarballs built, and of bundles uploaded, concurrently.')
     parser.add_argument('-s', '--server', metavar='SERVER', type=str, default='pywar.ddns.net',
                         help='PyWar server for uploading this code to.')
     parser.add_argument('-p', '--port', metavar='PORT', type=int, required=True,
@@ -35,22 +88,317 @@ def parse_args():
                         help='Strategic implementation module name.')
     parser.add_argument('--password', metavar='PASSWORD', type=str, default=None,
                         help='Password for logging in to the server')
-    return parser.parse_args()
+    parser.add_argument('--log-level', metavar='LEVEL', type=str, default=None,
+                        choices=['debug', 'info', 'warning', 'off'],
+                        help='Default log level of the uploaded code.')
+    parser.add_argument('--log-config', metavar='PATH', type=str, default=None,
+                        help='Log configuration file to upload as {}.'.format(LOG_CONFIG_FILENAME))
+    parser.add_argument('--minimize', action='store_true',
+                        help='Upload only the modules imported (directly or not) by the tactical and '
+                             'strategic modules, and data files.')
+    parser.add_argument('--precompile', action='store_true',
+                        help='Also upload byte-compiled modules, so they are not compiled on the first turn.')
+    parser.add_argument('--python', metavar='PATH', type=str, default=sys.executable,
+                        help='Python interpreter of the server, for --precompile and --report.')
+    parser.add_argument('--report', action='store_true',
+                        help='Print the size and the cold import time of each bundle.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Build the bundles (and report them with --report), without uploading.')
+    parser.add_argument('--manifest', metavar='PATH', type=str, default=DEFAULT_MANIFEST,
+                        help='Local manifest of the last uploaded bundles.')
+    parser.add_argument('--force', action='store_true',
+                        help='Upload even if the bundle has not changed since the last upload.')
+    parser.add_argument('--full', action='store_true',
+                        help='Always upload the full bundle, even if the server accepts deltas.')
+    args = parser.parse_args()
+    if args.name is not None and args.directory is None:
+        parser.error('-n requires -d')
+    if args.directory is not None and args.name is None and args.variants is None:
+        parser.error('-d requires -n, unless --variants is given')
+    if args.directory is None and not args.bundle and args.variants is None:
+        parser.error('either -d and -n, --bundle or --variants are required')
+    if args.jobs < 1:
+        parser.error('--jobs must be positive')
+    return args
 
 
-def add_directory_to_tarball(tarball, directory, base_dir=None):
-    for filename in os.listdir(directory):
+def list_directory(directory, base_dir=None):
+    """Returns a dict mapping the archive name of each file to upload to its path."""
+    files = {}
+    for filename in sorted(os.listdir(directory)):
+        if filename in IGNORED_NAMES:
+            continue
         real_path = os.path.join(directory, filename)
         if base_dir is None:
             arcfilename = filename
         else:
             arcfilename = '/'.join([base_dir, filename])
         if os.path.isfile(real_path):
-            tarball.add(real_path, arcfilename)
+            files[arcfilename] = real_path
         elif os.path.isdir(real_path):
-            add_directory_to_tarball(tarball, real_path, arcfilename)
+            files.update(list_directory(real_path, arcfilename))
         else:
             print('Ignoring', filename, 'for it is not recognized as a file or directory')
+    return files
+
+
+def get_log_config(args):
+    """Returns the log configuration to upload, or None to upload the directory as is."""
+    if args.log_config is None and args.log_level is None:
+        return None
+    config = {}
+    if args.log_config is not None:
+        with open(args.log_config) as config_file:
+            config = json.load(config_file)
+    if args.log_level is not None:
+        config['level'] = args.log_level
+    return config
+
+
+def get_module_names(files):
+    """Returns a dict mapping the name of each module in the files to its archive name."""
+    modules = {}
+    for arcfilename in files:
+        if not arcfilename.endswith('.py'):
+            continue
+        parts = arcfilename[:-len('.py')].split('/')
+        if parts[-1] == '__init__':
+            parts.pop()
+        if parts:
+            modules['.'.join(parts)] = arcfilename
+    return modules
+
+
+def get_imported_names(source, module, is_package):
+    """Returns the names of all the modules a module may import.
+
+    Imports anywhere in the module count, including inside functions. The
+    names of imported objects are also returned, as they may be submodules.
+    """
+    tree = ast.parse(source)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            base = node.module or ''
+            if node.level:
+                package = module.split('.')
+                if not is_package:
+                    package.pop()
+                package = package[:len(package) - node.level + 1]
+                base = '.'.join(package + ([base] if base else []))
+            if base:
+                names.add(base)
+            names.update('.'.join(filter(None, [base, alias.name])) for alias in node.names)
+    return names
+
+
+def find_reachable_modules(files, roots):
+    """Returns the archive names of the modules imported, directly or not, by the root modules."""
+    modules = get_module_names(files)
+    reachable = set()
+    pending = list(roots)
+    while pending:
+        name = pending.pop()
+        parts = name.split('.')
+        # Importing a submodule also imports its parent packages.
+        for i in range(1, len(parts) + 1):
+            arcfilename = modules.get('.'.join(parts[:i]))
+            if arcfilename is None or arcfilename in reachable:
+                continue
+            reachable.add(arcfilename)
+            source = files[arcfilename]
+            if not isinstance(source, bytes):
+                with open(source, 'rb') as source_file:
+                    source = source_file.read()
+            module = '.'.join(parts[:i])
+            pending.extend(get_imported_names(source, module, arcfilename.endswith('/__init__.py')))
+    return reachable
+
+
+def minimize_bundle(args, files):
+    """Removes the modules which are not reachable from the tactical and strategic modules.
+
+    Files which are not modules (such as configuration files) are kept.
+    """
+    reachable = find_reachable_modules(files, [args.tactical_module, args.strategic_module])
+    removed = sorted(arcfilename for arcfilename in files
+                     if arcfilename.endswith('.py') and arcfilename not in reachable)
+    if removed:
+        print('{}: leaving out unused modules: {}'.format(args.name, ', '.join(removed)))
+    return {arcfilename: source for arcfilename, source in files.items() if arcfilename not in removed}
+
+
+def precompile_bundle(args, files):
+    """Adds the byte-compiled modules of the files, compiled by the target interpreter.
+
+    Modules are compiled to unchecked hash-based .pyc files, which are loaded
+    without checking their sources (the bundle never changes on the server).
+    """
+    modules = {arcfilename: source for arcfilename, source in files.items()
+               if arcfilename.endswith('.py') and not isinstance(source, bytes)}
+    with tempfile.TemporaryDirectory() as directory:
+        outputs = {source: [os.path.join(directory, '{}.pyc'.format(i)), arcfilename]
+                   for i, (arcfilename, source) in enumerate(sorted(modules.items()))}
+        result = subprocess.run([args.python, '-c', COMPILE_SCRIPT], input=json.dumps(outputs),
+                                capture_output=True, text=True, check=True)
+        cache_tag = result.stdout.strip()
+        files = dict(files)
+        for source, (cfile, arcfilename) in outputs.items():
+            head, _, tail = arcfilename.rpartition('/')
+            pyc = '__pycache__/{}.{}.pyc'.format(tail[:-len('.py')], cache_tag)
+            with open(cfile, 'rb') as compiled_file:
+                files['/'.join(filter(None, [head, pyc]))] = compiled_file.read()
+    return files
+
+
+def extract_bundle(files, directory):
+    for arcfilename, source in files.items():
+        path = os.path.join(directory, *arcfilename.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if isinstance(source, bytes):
+            with open(path, 'wb') as output:
+                output.write(source)
+        else:
+            shutil.copyfile(source, path)
+
+
+def measure_import_time(args, files):
+    """Returns the best time (in seconds) of importing the tactical and strategic modules.
+
+    Every run is a fresh interpreter, which does not write byte-compiled files,
+    as on the first turn on the server.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    with tempfile.TemporaryDirectory() as directory:
+        extract_bundle(files, directory)
+        times = []
+        for _ in range(IMPORT_TIME_RUNS):
+            result = subprocess.run([args.python, '-c', IMPORT_TIME_SCRIPT, args.tactical_module,
+                                     args.strategic_module], cwd=directory, env=env,
+                                    capture_output=True, text=True, check=True)
+            times.append(float(result.stdout))
+    return min(times)
+
+
+def report_bundle(args, files):
+    tarball = io.BytesIO()
+    write_tarball(files, tarball)
+    print('{}: {} files, {:.1f} KB compressed, imported in {:.1f} ms'.format(
+        args.name, len(files), len(tarball.getvalue()) / 1024, measure_import_time(args, files) * 1000))
+
+
+def get_bundle(args):
+    """Returns the files to upload.
+
+    The returned dict maps the archive name of each file to its path, or to its
+    content (as bytes) for generated files.
+    """
+    files = list_directory(args.directory)
+    log_config = get_log_config(args)
+    if log_config is not None:
+        files[LOG_CONFIG_FILENAME] = json.dumps(log_config, indent=4).encode('utf8')
+    if args.minimize:
+        files = minimize_bundle(args, files)
+    if args.precompile:
+        files = precompile_bundle(args, files)
+    if args.report:
+        report_bundle(args, files)
+    return files
+
+
+def hash_file(source):
+    """Returns the SHA-256 of a file, given its path or its content."""
+    digest = hashlib.sha256()
+    if isinstance(source, bytes):
+        digest.update(source)
+        return digest.hexdigest()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bundle(hashes):
+    """Returns the hash of a bundle, given the hashes of its files."""
+    digest = hashlib.sha256()
+    for arcfilename in sorted(hashes):
+        digest.update('{}\0{}\n'.format(arcfilename, hashes[arcfilename]).encode('utf8'))
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    with open(path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=4, sort_keys=True)
+
+
+def get_manifest_key(args):
+    """Returns the key of the bundle in the manifest.
+
+    Bundles given by --bundle or --variants are told apart by their names too.
+    The name given by -n is not a part of the key, as it may change on every
+    upload (such as in CI).
+    """
+    key = '{}:{}:{}:{}:{}'.format(args.server, args.port, os.path.abspath(args.directory),
+                                  args.tactical_module, args.strategic_module)
+    if args.manifest_name is not None:
+        key += ':' + args.manifest_name
+    return key
+
+
+def load_variants(path, args):
+    """Loads a variants file, and returns the arguments of each variant.
+
+    The file holds a JSON list of objects, each describing a variant:
+        {
+            "name": "aggressive",                 # Required, the code name.
+            "directory": "variants/aggressive",   # Defaults to -d.
+            "tactical": "simple_tactical",        # Defaults to --tactical-module.
+            "strategic": "aggressive_strategic",  # Defaults to --strategic-module.
+            "log_level": "off",                   # Defaults to --log-level.
+            "log_config": "logs/quiet.json"       # Defaults to --log-config.
+        }
+    Variants are told apart in the upload manifest by their names.
+    """
+    with open(path) as variants_file:
+        variants = json.load(variants_file)
+    result = []
+    for variant in variants:
+        variant_args = dict(
+            vars(args),
+            name=variant['name'],
+            manifest_name=variant['name'],
+            directory=variant.get('directory', args.directory),
+            tactical_module=variant.get('tactical', args.tactical_module),
+            strategic_module=variant.get('strategic', args.strategic_module),
+            log_level=variant.get('log_level', args.log_level),
+            log_config=variant.get('log_config', args.log_config),
+        )
+        if variant_args['directory'] is None:
+            raise ValueError('Variant {!r} has no directory'.format(variant['name']))
+        result.append(argparse.Namespace(**variant_args))
+    return result
+
+
+def get_bundle_args(args):
+    """Returns the arguments of each bundle to upload, as copies of args."""
+    result = []
+    if args.directory is not None and args.name is not None:
+        result.append(argparse.Namespace(**dict(vars(args), manifest_name=None)))
+    result += [argparse.Namespace(**dict(vars(args), name=name, directory=directory, manifest_name=name))
+               for name, directory in args.bundle]
+    if args.variants is not None:
+        result += load_variants(args.variants, args)
+    return result
 
 
 def get_password(args):
@@ -63,61 +411,293 @@ def get_ssl_context():
     return context
 
 
-def authenticate(args):
-    encoded_password = urllib.parse.quote(get_password(args), safe='')
-    body = f'password={encoded_password}'
+class Session:
+    """A persistent connection to the server, logged in once for all the requests.
+
+    Requests failing due to connection errors or transient statuses are retried
+    with exponential backoff, over a new connection.
+    """
+
+    def __init__(self, args, cookie=None):
+        self.server = args.server
+        self.port = args.port
+        self.cookie = cookie
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = http.client.HTTPSConnection(self.server, self.port, timeout=TIMEOUT,
+                                                    context=get_ssl_context())
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
 
-    conn = http.client.HTTPSConnection(args.server, args.port, timeout=TIMEOUT, context=get_ssl_context())
-    conn.request('POST', '/login', body, AUTHENTICATIO_REQUEST_HEADERS)
-    response = conn.getresponse()
-    return response.getheader('Set-Cookie')
+    def request(self, method, path, body=None, headers=None):
+        """Sends a request, and returns its response, which has been fully read.
 
+        `body` may be a callable returning the body, for bodies which can be
+        sent only once (such as iterators); it is called again on every retry.
+        """
+        headers = dict(headers or {})
+        if self.cookie is not None:
+            headers['Cookie'] = self.cookie
+        for attempt in range(RETRIES + 1):
+            if attempt:
+                time.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+            try:
+                conn = self._connect()
+                conn.request(method, path, body() if callable(body) else body, headers)
+                response = conn.getresponse()
+                response.body = response.read()
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                if attempt == RETRIES:
+                    raise
+                print('Retrying {} {} after error: {}'.format(method, path, e), file=sys.stderr)
+                continue
+            if response.status not in TRANSIENT_STATUSES or attempt == RETRIES:
+                return response
+            self.close()
+            print('Retrying {} {} after status {}'.format(method, path, response.status), file=sys.stderr)
 
-def upload_file(args, cookie):
+    def login(self, password):
+        """Logs in, and returns True on success."""
+        encoded_password = urllib.parse.quote(password, safe='')
+        body = f'password={encoded_password}'
+        response = self.request('POST', '/login', body, AUTHENTICATIO_REQUEST_HEADERS)
+        self.cookie = response.getheader('Set-Cookie')
+        return bool(self.cookie)
+
+    def get_capabilities(self):
+        """Returns the upload capabilities of the server, as a dict.
+
+        Servers supporting delta uploads answer `GET /code/capabilities` with a
+        JSON object containing `"delta": true`. Any other answer means no
+        capabilities.
+        """
+        try:
+            response = self.request('GET', '/code/capabilities', headers=CAPABILITIES_REQUEST_HEADERS)
+            if response.status != 200:
+                return {}
+            capabilities = json.loads(response.body)
+        except (OSError, http.client.HTTPException, ValueError):
+            return {}
+        return capabilities if isinstance(capabilities, dict) else {}
+
+
+def write_tarball(files, fileobj):
+    """Writes a gzipped tarball of the given files (see `get_bundle`) into the file object."""
+    with tarfile.open(fileobj=fileobj, mode='w:gz') as tarball:
+        for arcfilename, source in files.items():
+            if isinstance(source, bytes):
+                info = tarfile.TarInfo(arcfilename)
+                info.size = len(source)
+                tarball.addfile(info, io.BytesIO(source))
+            else:
+                tarball.add(source, arcfilename)
+
+
+def get_multipart_envelope(args, extra_fields=None):
+    """Returns the parts of the upload body before and after the tarball."""
     form_data = {
         'tactical': args.tactical_module,
         'strategic': args.strategic_module,
         'overwrite': 'on',
         'name': args.name,
     }
+    if extra_fields:
+        form_data.update(extra_fields)
 
-    body = b''
+    head = []
     for k, v in form_data.items():
-        body += '--{}\n'.format(BOUNDARY).encode('utf8')
-        body += 'Content-Disposition: form-data; name="{}"\n'.format(k).encode('utf8')
-        body += '\n{}\n'.format(v).encode('utf8')
+        head.append('--{}\n'.format(BOUNDARY).encode('utf8'))
+        head.append('Content-Disposition: form-data; name="{}"\n'.format(k).encode('utf8'))
+        head.append('\n{}\n'.format(v).encode('utf8'))
+
+    head.append('--{}\n'.format(BOUNDARY).encode('utf8'))
+    head.append(b'Content-Disposition: form-data; name="tarball"; filename="code.tar.gz"')
+    head.append(b'Content-Type: application/tar+gzip\n')
+    head.append(b'\n')
+
+    tail = b'\n' + '--{}--\n'.format(BOUNDARY).encode('utf8')
+    return b''.join(head), tail
+
 
-    body += '--{}\n'.format(BOUNDARY).encode('utf8')
-    body += b'Content-Disposition: form-data; name="tarball"; filename="code.tar.gz"'
-    body += b'Content-Type: application/tar+gzip\n'
+def iter_body(head, fileobj, tail):
+    """Yields the upload body, reading the tarball in chunks."""
+    yield head
+    while True:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+    yield tail
 
-    inmemory_tar = io.BytesIO()
-    with tarfile.open(fileobj=inmemory_tar, mode='w:gz') as tarball:
-        add_directory_to_tarball(tarball, args.directory)
 
-    body += b'\n'
-    body += inmemory_tar.getbuffer()
-    body += b'\n'
-    body += '--{}--\n'.format(BOUNDARY).encode('utf8')
+def build_tarball(files, directory):
+    """Writes a gzipped tarball of the files into a new file in the directory.
 
-    headers = {'Cookie': cookie}
-    headers.update(UPLOAD_REQUEST_HEADERS)
+    Returns the path of the tarball. This function runs in worker processes.
+    """
+    with tempfile.NamedTemporaryFile(dir=directory, suffix='.tar.gz', delete=False) as tarball_file:
+        write_tarball(files, tarball_file)
+    return tarball_file.name
 
-    conn = http.client.HTTPSConnection(args.server, args.port, timeout=TIMEOUT, context=get_ssl_context())
-    conn.request('POST', '/code/upload', body, headers)
-    response = conn.getresponse()
-    if response.status != 302:
-        print('Failure:', response.status, response.reason, file=sys.stderr)
-    else:
-        print('Success')
+
+def upload_tarball(session, args, path, extra_fields=None):
+    """Uploads a tarball file, and returns the response status."""
+    head, tail = get_multipart_envelope(args, extra_fields)
+    size = os.path.getsize(path)
+    with open(path, 'rb') as tarball_file:
+
+        def body():
+            tarball_file.seek(0)
+            return iter_body(head, tarball_file, tail)
+
+        headers = {'Content-Length': str(len(head) + size + len(tail))}
+        headers.update(UPLOAD_REQUEST_HEADERS)
+        response = session.request('POST', '/code/upload', body, headers)
+    if response.status != UPLOAD_SUCCESS and response.status != DELTA_REJECTED:
+        print('{}: Failure: {} {}'.format(args.name, response.status, response.reason), file=sys.stderr)
+    return response.status
+
+
+class Upload:
+    """The plan of uploading a single bundle.
+
+    This class exports the following fields:
+    * args: The arguments of the bundle (see `get_bundle_args`).
+    * files: Maps the archive name of each file of the bundle to its source.
+    * entry: The manifest entry of the bundle.
+    * key: The manifest key of the bundle.
+    * sent_files: The files to send, which are only the changed ones for deltas.
+    * extra_fields: Additional form fields (used by deltas), or None.
+    * tarball: The hash of the tarball of `sent_files`. Uploads of identical
+               files share a single tarball.
+    """
+
+    def __init__(self, args, files, entry, key, previous, delta):
+        self.args = args
+        self.files = files
+        self.entry = entry
+        self.key = key
+        hashes = entry['files']
+        if previous is not None and delta:
+            self.sent_files = {arcfilename: files[arcfilename] for arcfilename in files
+                               if previous['files'].get(arcfilename) != hashes[arcfilename]}
+            deleted = sorted(set(previous['files']) - set(files))
+            self.extra_fields = {
+                'base': previous['bundle'],
+                'bundle': entry['bundle'],
+                'deleted': json.dumps(deleted),
+            }
+        else:
+            self.sent_files = files
+            self.extra_fields = None
+        self.tarball = hash_bundle({arcfilename: hashes[arcfilename] for arcfilename in self.sent_files})
+
+
+def build_tarballs(uploads, directory, jobs):
+    """Builds the tarballs of the uploads, and returns a dict mapping their hashes to paths.
+
+    Tarballs are compressed concurrently, in a pool of `jobs` processes.
+    """
+    unique = {}
+    for upload in uploads:
+        unique.setdefault(upload.tarball, upload.sent_files)
+    if jobs == 1 or len(unique) == 1:
+        return {tarball: build_tarball(files, directory) for tarball, files in unique.items()}
+    with concurrent.futures.ProcessPoolExecutor(min(jobs, len(unique))) as executor:
+        futures = {tarball: executor.submit(build_tarball, files, directory)
+                   for tarball, files in unique.items()}
+        return {tarball: future.result() for tarball, future in futures.items()}
+
+
+def upload_all(session, args, uploads, tarballs, directory):
+    """Uploads all the bundles concurrently, and yields the uploads as they succeed.
+
+    Uploads use the given (logged in) session first. Concurrent uploads open
+    more sessions sharing its cookie, which are closed when done.
+    """
+    idle_sessions = queue.SimpleQueue()
+    idle_sessions.put(session)
+    sessions = []
+
+    def upload(plan):
+        try:
+            worker_session = idle_sessions.get_nowait()
+        except queue.Empty:
+            worker_session = Session(args, session.cookie)
+            sessions.append(worker_session)
+        try:
+            if plan.extra_fields is not None:
+                print('{}: uploading {} changed files'.format(plan.args.name, len(plan.sent_files)))
+            status = upload_tarball(worker_session, plan.args, tarballs[plan.tarball], plan.extra_fields)
+            if status == DELTA_REJECTED:
+                print('{}: delta rejected by the server, uploading the full bundle'.format(plan.args.name))
+                status = upload_tarball(worker_session, plan.args, build_tarball(plan.files, directory))
+            return status
+        finally:
+            idle_sessions.put(worker_session)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(min(args.jobs, len(uploads))) as executor:
+            futures = {executor.submit(upload, plan): plan for plan in uploads}
+            for future in concurrent.futures.as_completed(futures):
+                plan = futures[future]
+                try:
+                    status = future.result()
+                except (OSError, http.client.HTTPException) as e:
+                    print('{}: Failure: {}'.format(plan.args.name, e), file=sys.stderr)
+                    continue
+                if status == UPLOAD_SUCCESS:
+                    print('{}: Success'.format(plan.args.name))
+                    yield plan
+    finally:
+        for worker_session in sessions:
+            worker_session.close()
 
 
 def main(args):
-    cookie = authenticate(args)
-    if not cookie:
-        print('Invalid password', file=sys.stderr)
-    else:
-        upload_file(args, cookie)
+    manifest = load_manifest(args.manifest)
+    pending = []
+    for bundle_args in get_bundle_args(args):
+        files = get_bundle(bundle_args)
+        hashes = {arcfilename: hash_file(source) for arcfilename, source in files.items()}
+        entry = {
+            'bundle': hash_bundle(hashes),
+            'files': hashes,
+            'tactical': bundle_args.tactical_module,
+            'strategic': bundle_args.strategic_module,
+        }
+        key = get_manifest_key(bundle_args)
+        if manifest.get(key) == entry and not args.force:
+            print('{}: unchanged since the last upload, skipping'.format(bundle_args.name))
+            continue
+        pending.append((bundle_args, files, entry, key))
+    if not pending or args.dry_run:
+        return
+
+    session = Session(args)
+    try:
+        if not session.login(get_password(args)):
+            print('Invalid password', file=sys.stderr)
+            return
+        delta = not args.full and any(manifest.get(key) is not None for *_, key in pending)
+        delta = delta and bool(session.get_capabilities().get('delta'))
+
+        uploads = [Upload(bundle_args, files, entry, key, manifest.get(key), delta)
+                   for bundle_args, files, entry, key in pending]
+        with tempfile.TemporaryDirectory() as directory:
+            tarballs = build_tarballs(uploads, directory, args.jobs)
+            for plan in upload_all(session, args, uploads, tarballs, directory):
+                manifest[plan.key] = plan.entry
+                save_manifest(args.manifest, manifest)
+    finally:
+        session.close()
 
 
 if __name__ == '__main__':